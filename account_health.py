@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+ACTIVE = "active"
+SUSPECT = "suspect"
+COOLING = "cooling"
+BANNED = "banned"
+
+
+class AccountHealth:
+    # Per account state machine, persisted so restarts keep cooldowns:
+    #   active  --empty answer-->  suspect  --`ban_after` in a row-->  banned
+    #   any     --error/rest-->    cooling
+    #   cooling --time up-->       active,  banned --time up--> suspect
+    # Only active and suspect accounts should be polled.
+    def __init__(self, path="account_health.json", ban_after=2, ban_cooldown=5 * 60 * 60):
+        self.path = path
+        self.ban_after = ban_after
+        self.ban_cooldown = ban_cooldown
+        self.lock = threading.Lock()
+        self.accounts = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.accounts = json.load(f)
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.accounts, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def _set(self, account, state, until=None, strikes=None):
+        entry = self.accounts.setdefault(account, {"strikes": 0})
+        entry.update(state=state, since=time.time(), until=until)
+        if strikes is not None:
+            entry["strikes"] = strikes
+        self._save()
+        log.info(f"Account {account}: {state}" + (f" until {time.ctime(until)}" if until else ""))
+        return state
+
+    def state(self, account):
+        with self.lock:
+            entry = self.accounts.get(account)
+            if entry is None:
+                return ACTIVE
+            if entry["until"] and time.time() >= entry["until"]:
+                return self._set(account, SUSPECT if entry["state"] == BANNED else ACTIVE)
+            return entry["state"]
+
+    def is_available(self, account):
+        return self.state(account) in (ACTIVE, SUSPECT)
+
+    def wait_time(self, account):
+        # Seconds until the account may be polled again
+        if self.is_available(account):
+            return 0
+        return max(0, self.accounts[account]["until"] - time.time())
+
+    def report_ok(self, account):
+        with self.lock:
+            entry = self.accounts.get(account)
+            if entry is None or entry["state"] != ACTIVE or entry["strikes"]:
+                self._set(account, ACTIVE, strikes=0)
+
+    def report_empty(self, account):
+        # An empty feed / no appointments anywhere: a ban or just no slots
+        with self.lock:
+            strikes = self.accounts.get(account, {}).get("strikes", 0) + 1
+            if strikes >= self.ban_after:
+                return self._set(account, BANNED, time.time() + self.ban_cooldown, strikes)
+            return self._set(account, SUSPECT, strikes=strikes)
+
+    def cool(self, account, seconds):
+        # Work break or an error: pause the account without counting a strike
+        with self.lock:
+            return self._set(account, COOLING, time.time() + seconds)
+
+    def healthiest(self, accounts):
+        # Available accounts, active ones first
+        order = {ACTIVE: 0, SUSPECT: 1}
+        states = {account: self.state(account) for account in accounts}
+        return sorted((a for a in accounts if states[a] in order), key=lambda a: order[states[a]])
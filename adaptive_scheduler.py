@@ -0,0 +1,63 @@
+import random
+import time
+from collections import deque
+
+hour = 60 * 60
+
+
+class AdaptiveScheduler:
+    # Picks the wait before the next poll of a facility instead of a uniform
+    # random.randint(lower, upper). The base pace spends `budget` requests per
+    # account every `window_hours`; hours in which dates were historically
+    # released get a shorter interval, quiet facilities back off, and a
+    # sliding window keeps every account within its budget.
+    def __init__(self, lower, upper, window_hours, budget=None, backoff=1.3, max_backoff_steps=5, jitter=0.2):
+        self.configure(lower, upper, window_hours, budget)
+        self.backoff = backoff
+        self.max_backoff_steps = max_backoff_steps
+        self.jitter = jitter
+        self.hour_weights = {}
+        self.sent = {}
+        self.idle = {}
+
+    def configure(self, lower, upper, window_hours, budget=None):
+        # Also called on a config reload; what was learned and sent is kept
+        self.lower = lower
+        self.upper = upper
+        self.window = window_hours * hour
+        # Default budget: what uniform waits between the bounds used to send
+        self.budget = budget or max(1, int(self.window / ((lower + upper) / 2)))
+
+    def learn(self, facility_id, release_hours):
+        # release_hours: Counter hour -> releases (HistoryStore.release_hours).
+        # Weights average to 1 over the day so the total volume stays the same.
+        total = sum(release_hours.values())
+        if not total:
+            return
+        mean = total / 24
+        self.hour_weights[facility_id] = {h: max(0.25, min(4.0, (release_hours[h] + mean * 0.1) / (mean * 1.1))) for h in range(24)}
+
+    def record(self, account, facility_id, changed, now=None):
+        now = time.time() if now is None else now
+        self.sent.setdefault(account, deque()).append(now)
+        self.idle[facility_id] = 0 if changed else self.idle.get(facility_id, 0) + 1
+
+    def next_delay(self, account, facility_id, now=None):
+        now = time.time() if now is None else now
+        weights = self.hour_weights.get(facility_id)
+        weight = weights[time.gmtime(now).tm_hour] if weights else 1.0
+        delay = self.window / self.budget / weight
+        if weight < 1.0:
+            # Nothing changes and it's outside the learned release hours: slow down.
+            # Without learned hours every hour may be a release hour, so keep the pace.
+            delay *= self.backoff ** min(self.idle.get(facility_id, 0), self.max_backoff_steps)
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        delay = max(self.lower, min(self.upper, delay))
+
+        sent = self.sent.get(account, deque())
+        while sent and sent[0] <= now - self.window:
+            sent.popleft()
+        if len(sent) >= self.budget:
+            # Budget spent: wait until the oldest request leaves the window
+            delay = max(delay, sent[0] + self.window - now)
+        return delay
@@ -0,0 +1,80 @@
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlparse
+
+import metrics
+
+
+def feed_key(url, *parts):
+    # The same feed of the same site, whichever account asks for it
+    return (urlparse(url).netloc,) + tuple(str(p) for p in parts)
+
+
+class AvailabilityCache:
+    # The latest result of a feed every account watching the same facility
+    # sees. Within ttl seconds a result is reused instead of fetched again,
+    # and while one account fetches, the others asking for the same key wait
+    # for its result instead of sending their own request (single flight).
+    # With a directory the results and the wait are shared by every process
+    # using it: the coordinator's workers or several visa_reschedule.py runs.
+    def __init__(self, ttl=5, directory=""):
+        self.ttl = ttl
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.entries = {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, re.sub(r"[^\w.-]+", "_", "-".join(key)))
+
+    @contextmanager
+    def _file_lock(self, key):
+        with open(self._path(key) + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read(self, key):
+        entry = self.entries.get(key)
+        if self.directory:
+            try:
+                with open(self._path(key) + ".json") as f:
+                    stored = json.load(f)
+            except (OSError, ValueError):
+                stored = None
+            if stored and (entry is None or stored["fetched_at"] > entry["fetched_at"]):
+                entry = stored
+        return entry
+
+    def _write(self, key, entry):
+        self.entries[key] = entry
+        if self.directory:
+            path = self._path(key) + ".json"
+            with open(path + ".tmp", "w") as f:
+                json.dump(entry, f)
+            os.replace(path + ".tmp", path)
+
+    def get(self, key, fetch, account=None, shareable=bool):
+        # -> (value, fetched): fetched is True when this call sent the request.
+        # Results failing shareable (an empty feed can mean this account is
+        # banned) go back to the caller only.
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock, self._file_lock(key) if self.directory else nullcontext():
+            entry = self._read(key)
+            if entry and time.time() - entry["fetched_at"] < self.ttl:
+                metrics.inc("availability_cache_hits", feed=key[-1])
+                return entry["value"], False
+            value = fetch()
+            if shareable(value):
+                self._write(key, {"fetched_at": time.time(), "value": value, "account": account})
+            return value, True
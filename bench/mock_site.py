@@ -0,0 +1,255 @@
+import argparse
+import json
+import re
+import secrets
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for ais.usvisa-info.com: sign in, days/times JSON, the
+# reschedule form, group and payment pages, plus a Telegram Bot API stub.
+# Dates are released on a script or a timer; latency and bans are injected.
+# GET /__stats returns counters and release -> booking latencies.
+
+SIGN_IN_PAGE = """<html><body>
+<a class="down-arrow bounce" href="#form" onclick="document.getElementById('form').style.display='block'">v</a>
+<form id="form" method="post" action="/{cc}/niv/users/sign_in">
+<input type="email" id="user_email" name="user[email]">
+<input type="password" id="user_password" name="user[password]">
+<div class="icheckbox" onclick="this.classList.toggle('checked');document.getElementById('policy').value=1">
+<input type="checkbox" id="policy_confirmed" name="policy_confirmed"></div>
+<input type="hidden" id="policy" name="policy" value="0">
+<input type="submit" name="commit" value="Sign In">
+</form></body></html>"""
+
+GROUP_PAGE = """<html><body>
+<p class="consular-appt">Consular Appointment: {appointment}, 08:00 local time</p>
+<a href="/{cc}/niv/schedule/1/continue_actions">{continue_text}</a>
+</body></html>"""
+
+APPOINTMENT_PAGE = """<html><body><form method="post" action="/{cc}/niv/schedule/{sid}/appointment">
+<input type="hidden" name="utf8" value="&#x2713;">
+<input type="hidden" name="authenticity_token" value="{token}">
+<input type="hidden" name="confirmed_limit_message" value="1">
+<input type="hidden" name="use_consulate_appointment_capacity" value="true">
+</form></body></html>"""
+
+PAYMENT_PAGE = """<html><body><div id="paymentOptions"><div>Pay</div><div><table>
+<thead><tr><th>Location</th><th>First available</th></tr></thead><tbody>{rows}</tbody>
+</table></div></div></body></html>"""
+
+
+class MockSite:
+    def __init__(self, facilities=(96, 97), latency=0.0, ban_after=0, base_dates=50, appointment=None, continue_text="Continue"):
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.ban_after = ban_after
+        self.continue_text = continue_text
+        self.appointment = appointment or date.today() + timedelta(days=400)
+        self.sessions = {}
+        # facility -> {iso date: released_at}; base dates are always there, late in the calendar
+        far = self.appointment + timedelta(days=30)
+        self.dates = {f: {(far + timedelta(days=i)).isoformat(): None for i in range(base_dates)} for f in facilities}
+        self.releases = []
+        self.counts = {}
+        self.started = time.time()
+
+    def count(self, name):
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def release(self, facility, iso_date):
+        with self.lock:
+            now = time.time()
+            self.dates.setdefault(facility, {})[iso_date] = now
+            self.releases.append({"facility": facility, "date": iso_date, "released_at": now, "booked_at": None})
+
+    def book(self, facility, iso_date):
+        with self.lock:
+            if iso_date not in self.dates.get(facility, {}):
+                return False
+            del self.dates[facility][iso_date]
+            for r in self.releases:
+                if r["facility"] == facility and r["date"] == iso_date and r["booked_at"] is None:
+                    r["booked_at"] = time.time()
+            return True
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(r["booked_at"] - r["released_at"] for r in self.releases if r["booked_at"])
+            return {
+                "uptime": time.time() - self.started,
+                "counts": dict(self.counts),
+                "releases": len(self.releases),
+                "booked": len(latencies),
+                "release_to_booking": latencies,
+            }
+
+
+def release_on_timer(site, facility, every, start=None):
+    # A new date every `every` seconds, each earlier than the previous one so
+    # a bot that just booked still finds the next one worth taking
+    day = start or site.appointment - timedelta(days=1)
+    while True:
+        time.sleep(every)
+        site.release(facility, day.isoformat())
+        day -= timedelta(days=1)
+
+
+def release_from_script(site, script):
+    # script: [{"at": seconds after start, "facility": 96, "date": "YYYY-MM-DD"}, ...]
+    t0 = time.time()
+    for item in sorted(script, key=lambda i: i["at"]):
+        time.sleep(max(0, t0 + item["at"] - time.time()))
+        site.release(item["facility"], item["date"])
+
+
+def make_handler(site):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send(self, status, body=b"", content_type="text/html; charset=utf-8", headers=()):
+            if isinstance(body, str):
+                body = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, data, status=200):
+            self.send(status, json.dumps(data), "application/json; charset=utf-8")
+
+        def session(self):
+            cookie = self.headers.get("Cookie", "")
+            match = re.search(r"_yatri_session=([\w-]+)", cookie)
+            return site.sessions.get(match.group(1)) if match else None
+
+        def form(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if url.path == "/__stats":
+                return self.send_json(site.stats())
+            time.sleep(site.latency)
+            if m := re.fullmatch(r"/([\w-]+)/niv/users/sign_in", url.path):
+                site.count("sign_in_page")
+                return self.send(200, SIGN_IN_PAGE.replace("{cc}", m.group(1)))
+            if m := re.fullmatch(r"/([\w-]+)/niv/users/sign_out", url.path):
+                site.count("sign_out")
+                return self.send(302, headers=[("Location", f"/{m.group(1)}/niv/users/sign_in"),
+                                               ("Set-Cookie", "_yatri_session=; Path=/; Max-Age=0")])
+            session = self.session()
+            if session is None:
+                site.count("unauthorized")
+                if url.path.endswith(".json"):
+                    return self.send_json({"error": "You need to sign in"}, 401)
+                cc = url.path.split("/")[1]
+                return self.send(302, headers=[("Location", f"/{cc}/niv/users/sign_in")])
+            if m := re.fullmatch(r"/([\w-]+)/niv/groups/\d+", url.path):
+                site.count("group")
+                appointment = site.appointment.strftime("%d %B, %Y")
+                return self.send(200, GROUP_PAGE.format(cc=m.group(1), appointment=appointment, continue_text=site.continue_text))
+            if m := re.fullmatch(r"/[\w-]+/niv/schedule/\d+/appointment/days/(\d+)\.json", url.path):
+                site.count("days")
+                session["polls"] += 1
+                if site.ban_after and session["polls"] > site.ban_after:
+                    site.count("banned")
+                    return self.send_json([])
+                with site.lock:
+                    dates = sorted(site.dates.get(int(m.group(1)), {}))
+                return self.send_json([{"date": d, "business_day": True} for d in dates])
+            if m := re.fullmatch(r"/[\w-]+/niv/schedule/\d+/appointment/times/(\d+)\.json", url.path):
+                site.count("times")
+                available = query.get("date") in site.dates.get(int(m.group(1)), {})
+                times = ["08:00", "08:15", "09:30"] if available else []
+                return self.send_json({"available_times": times, "business_times": times})
+            if m := re.fullmatch(r"/([\w-]+)/niv/schedule/(\d+)/appointment", url.path):
+                site.count("appointment_page")
+                return self.send(200, APPOINTMENT_PAGE.format(cc=m.group(1), sid=m.group(2), token=session["token"]))
+            if re.fullmatch(r"/[\w-]+/niv/schedule/\d+/payment", url.path):
+                site.count("payment")
+                rows = []
+                with site.lock:
+                    for facility, dates in sorted(site.dates.items()):
+                        first = min(dates) if dates else None
+                        status = date.fromisoformat(first).strftime("%d %B, %Y") if first else "No Appointments Available"
+                        if site.ban_after and session["polls"] >= site.ban_after:
+                            status = "No Appointments Available"
+                        rows.append(f"<tr><td>Facility {facility}</td><td>{status}</td></tr>")
+                session["polls"] += 1
+                return self.send(200, PAYMENT_PAGE.format(rows="".join(rows)))
+            self.send(404, "Not found")
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if m := re.fullmatch(r"/__release", url.path):
+                data = self.form()
+                site.release(int(data["facility"]), data["date"])
+                return self.send_json({"ok": True})
+            if re.fullmatch(r"/bot[^/]+/sendMessage", url.path):
+                site.count("telegram")
+                self.form()
+                return self.send_json({"ok": True, "result": {}})
+            time.sleep(site.latency)
+            if m := re.fullmatch(r"/([\w-]+)/niv/users/sign_in", url.path):
+                data = self.form()
+                site.count("logins")
+                if not data.get("user[email]") or not data.get("user[password]"):
+                    return self.send(200, SIGN_IN_PAGE.replace("{cc}", m.group(1)))
+                key = secrets.token_hex(16)
+                site.sessions[key] = {"email": data["user[email]"], "polls": 0, "token": secrets.token_urlsafe(24)}
+                return self.send(302, headers=[("Location", f"/{m.group(1)}/niv/groups/1"),
+                                               ("Set-Cookie", f"_yatri_session={key}; Path=/; HttpOnly")])
+            session = self.session()
+            if session is None:
+                return self.send(302, headers=[("Location", "/")])
+            if re.fullmatch(r"/[\w-]+/niv/schedule/\d+/appointment", url.path):
+                data = self.form()
+                site.count("booking_attempts")
+                ok = data.get("authenticity_token") == session["token"] and site.book(
+                    int(data.get("appointments[consulate_appointment][facility_id]", 0)),
+                    data.get("appointments[consulate_appointment][date]"),
+                )
+                site.count("booked" if ok else "booking_failed")
+                return self.send(200, "Successfully Scheduled" if ok else "Failed to schedule")
+            self.send(404, "Not found")
+
+    return Handler
+
+
+def serve(site, port=0, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), make_handler(site))
+    threading.Thread(target=server.serve_forever, name="mock-site", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for ais.usvisa-info.com")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--facility', type=int, action='append', help="default: 96 and 97")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every site request")
+    parser.add_argument('--ban-after', type=int, default=0, help="empty answers after N polls per session")
+    parser.add_argument('--release-every', type=float, default=0, help="release a new date every N seconds")
+    parser.add_argument('--script', help="JSON list of {at, facility, date} releases")
+    args = parser.parse_args()
+
+    facilities = args.facility or [96, 97]
+    site = MockSite(facilities, args.latency, args.ban_after)
+    server = serve(site, args.port)
+    if args.release_every:
+        threading.Thread(target=release_on_timer, args=(site, facilities[0], args.release_every), daemon=True).start()
+    if args.script:
+        with open(args.script) as f:
+            threading.Thread(target=release_from_script, args=(site, json.load(f)), daemon=True).start()
+    print(f"Mock site on http://127.0.0.1:{server.server_port}")
+    threading.Event().wait()
@@ -0,0 +1,175 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+import yaml
+
+from mock_site import MockSite, serve, release_on_timer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+# Runs visa_reschedule.py / visa_no_payment.py against bench/mock_site.py and
+# reports polls per second, CPU and RSS per session (the script plus its
+# chromedriver/Chrome children) and release -> booking latency percentiles.
+
+
+def reschedule_config(base_url, site):
+    return f"""[PERSONAL_INFO]
+USERNAME = bench@example.com
+PASSWORD = bench
+SCHEDULE_ID = 1
+GROUP_ID = 1
+PRIOD_START = {date.today().isoformat()}
+PRIOD_END = {site.appointment.isoformat()}
+YOUR_EMBASSY = en-il-ta
+BASE_URL = {base_url}
+
+[CHROMEDRIVER]
+LOCAL_USE = True
+HUB_ADDRESS =
+HTTP_POLLING = True
+POOL_SIZE = 1
+
+[NOTIFICATION]
+TELEGRAM_BOT_TOKEN = bench
+TELEGRAM_CHAT_ID = 1
+TELEGRAM_API_URL = {base_url}
+
+[TIME]
+RETRY_TIME_L_BOUND = 1
+RETRY_TIME_U_BOUND = 3
+WORK_LIMIT_TIME = 24
+WORK_COOLDOWN_TIME = 1
+BAN_COOLDOWN_TIME = 1
+REQUEST_BUDGET = 100000
+
+[HISTORY]
+DIR = history
+HEALTH_FILE = account_health.json
+"""
+
+
+def no_payment_config(base_url, accounts):
+    return {
+        'base_url': base_url,
+        'users': [{'email': f'bench{i}@example.com', 'password': 'bench', 'schedule_id': i + 1, 'group_id': i + 1} for i in range(accounts)],
+        'embassies': [
+            {'country_code': 'en-il', 'facility_id': 96, 'continue': 'Continue'},
+            {'country_code': 'en-il', 'facility_id': 97},
+        ],
+        'chrome_driver': {'local_use': True, 'hub_address': None, 'pool_size': 0},
+        'telegram': {'bot_token': 'bench', 'chat_id': 1, 'api_url': base_url},
+        'time': {'retry_lower_bound': 1, 'retry_upper_bound': 3, 'work_limit_hours': 24,
+                 'work_cooldown_hours': 1, 'ban_cooldown_hours': 1, 'request_budget': 100000},
+    }
+
+
+def process_tree(pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+                children.setdefault(ppid, []).append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    tree, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        tree.append(p)
+        todo.extend(children.get(p, []))
+    return tree
+
+
+def sample(pid):
+    # (cpu seconds, rss bytes) summed over the process and its children
+    cpu = rss = 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / CLK_TCK
+            rss += int(fields[21]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            pass
+    return cpu, rss
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run(target, args):
+    site = MockSite(latency=args.latency, ban_after=args.ban_after)
+    server = serve(site)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    workdir = tempfile.mkdtemp(prefix=f"bench_{target}_")
+    if target == "reschedule":
+        config_path = os.path.join(workdir, "config.ini")
+        with open(config_path, "w") as f:
+            f.write(reschedule_config(base_url, site))
+        sessions = 1
+    else:
+        config_path = os.path.join(workdir, "config.yaml")
+        with open(config_path, "w") as f:
+            yaml.safe_dump(no_payment_config(base_url, args.accounts), f)
+        sessions = args.accounts
+    if args.release_every:
+        threading.Thread(target=release_on_timer, args=(site, 96, args.release_every), daemon=True).start()
+
+    script = os.path.join(ROOT, f"visa_{target}.py")
+    log = open(os.path.join(workdir, "output.txt"), "w")
+    process = subprocess.Popen([sys.executable, script, "--config", config_path], cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+    peak_rss = cpu = 0
+    t0 = time.time()
+    try:
+        while time.time() - t0 < args.duration and process.poll() is None:
+            cpu, rss = sample(process.pid)
+            peak_rss = max(peak_rss, rss)
+            time.sleep(1)
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        server.shutdown()
+        log.close()
+    elapsed = time.time() - t0
+
+    stats = site.stats()
+    polls = stats["counts"].get("days", 0) + stats["counts"].get("payment", 0)
+    latencies = stats["release_to_booking"]
+    print(f"\n== {target} ({sessions} sessions, {elapsed:.0f}s, output in {workdir})")
+    print(f"polls/s:         {polls / elapsed:.2f} ({polls} polls, {stats['counts'].get('logins', 0)} logins)")
+    print(f"CPU per session: {cpu / sessions:.1f}s ({cpu / elapsed * 100 / sessions:.1f}% of a core)")
+    print(f"RSS per session: {peak_rss / sessions / 2**20:.0f} MiB peak")
+    if target == "reschedule":
+        p50, p99 = percentile(latencies, 0.5), percentile(latencies, 0.99)
+        print(f"bookings:        {stats['booked']}/{stats['releases']} releases")
+        if latencies:
+            print(f"release->booked: p50 {p50:.2f}s, p99 {p99:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the bots against the local mock site")
+    parser.add_argument('--target', choices=['reschedule', 'no_payment', 'both'], default='both')
+    parser.add_argument('--duration', type=float, default=120)
+    parser.add_argument('--accounts', type=int, default=2, help="accounts for visa_no_payment.py")
+    parser.add_argument('--release-every', type=float, default=15)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--ban-after', type=int, default=0)
+    args = parser.parse_args()
+
+    for target in (['reschedule', 'no_payment'] if args.target == 'both' else [args.target]):
+        run(target, args)
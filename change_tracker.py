@@ -0,0 +1,42 @@
+import hashlib
+import json
+from collections import namedtuple
+
+# added/removed: sorted ISO dates since the previous poll, feed: decoded response
+Delta = namedtuple("Delta", ["added", "removed", "feed"])
+
+
+class DateFeedTracker:
+    # Snapshot of one facility's days feed. Identical payloads are detected by
+    # their digest and skip JSON decoding entirely.
+    def __init__(self):
+        self.digest = None
+        self.dates = frozenset()
+        self.feed = []
+
+    def update(self, payload):
+        # Returns a Delta, or None when the response is byte-identical to the last one
+        raw = payload.encode() if isinstance(payload, str) else payload
+        digest = hashlib.blake2b(raw, digest_size=16).digest()
+        if digest == self.digest:
+            return None
+        feed = json.loads(raw)
+        dates = frozenset(d.get('date') for d in feed)
+        delta = Delta(sorted(dates - self.dates), sorted(self.dates - dates), feed)
+        self.digest, self.dates, self.feed = digest, dates, feed
+        return delta
+
+    def reset(self):
+        self.__init__()
+
+
+def format_delta(delta, limit=30):
+    def shorten(dates):
+        text = ", ".join(dates[:limit])
+        return text + f" (+{len(dates) - limit} more)" if len(dates) > limit else text
+    lines = []
+    if delta.added:
+        lines.append(f"New: {shorten(delta.added)}")
+    if delta.removed:
+        lines.append(f"Gone: {shorten(delta.removed)}")
+    return "\n".join(lines)
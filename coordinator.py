@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import atexit
+import json
+import logging
+import multiprocessing
+import os
+import queue
+
+import log_pipeline
+import visa_no_payment
+from notifier import TelegramNotifier, TELEGRAM_API
+
+log = logging.getLogger("coordinator")
+
+
+def shard_users(users, workers):
+    # Round-robin so every worker gets a similar number of accounts
+    return [users[i::workers] for i in range(workers) if users[i::workers]]
+
+
+def run_worker(index, fleet_config, users, results):
+    # Worker process: the asyncio poller of visa_no_payment.py for its shard,
+    # with its own browsers (local Chrome or sessions on the Selenium Grid)
+    shard_config = dict(fleet_config, users=users)
+    # Each worker owns the state files of its accounts
+    for key, default in (('account_health_file', 'account_health.json'), ('session_file', 'sessions.json')):
+        if fleet_config.get(key, default):
+            root, ext = os.path.splitext(fleet_config.get(key, default))
+            shard_config[key] = f"{root}.worker{index}{ext}"
+    log_config = dict(fleet_config.get('logging') or {})
+    if log_config.get('file', 'log_{date}.jsonl'):
+        root, ext = os.path.splitext(log_config.get('file', 'log_{date}.jsonl'))
+        shard_config['logging'] = dict(log_config, file=f"{root}.worker{index}{ext}")
+    # and its metrics: port + index and its own JSON dump
+    metrics_config = dict(fleet_config.get('metrics') or {})
+    if metrics_config.get('port'):
+        metrics_config['port'] += index
+    if metrics_config.get('json_file'):
+        root, ext = os.path.splitext(metrics_config['json_file'])
+        metrics_config['json_file'] = f"{root}.worker{index}{ext}"
+    shard_config['metrics'] = metrics_config
+
+    def report(email, embassy_config, appointments):
+        results.put((email, embassy_config['country_code'], appointments))
+
+    visa_no_payment.setup(shard_config, report)
+    asyncio.run(visa_no_payment.main())
+
+
+class AvailabilityView:
+    # (country_code, location) -> latest status reported by any account
+    def __init__(self):
+        self.status = {}
+
+    def update(self, country_code, appointments):
+        # Returns only the entries this report changed
+        changes = {}
+        for location, status in appointments.items():
+            key = (country_code, location)
+            if self.status.get(key) != status:
+                self.status[key] = status
+                changes[location] = status
+        return changes
+
+
+def start_worker(index, fleet_config, users, results):
+    process = multiprocessing.Process(
+        target=run_worker, args=(index, fleet_config, users, results), name=f"worker-{index}", daemon=True,
+    )
+    process.start()
+    log.info(f"Worker {index} started (pid {process.pid}) for {[u['email'] for u in users]}")
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shard the accounts of one fleet config across worker processes")
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--workers', type=int, default=0, help="default: one per accounts_per_worker accounts")
+    parser.add_argument('--accounts-per-worker', type=int, default=4)
+    args = parser.parse_args()
+
+    fleet_config = visa_no_payment.load_config(args.config)
+    users = fleet_config['users']
+    workers = args.workers or -(-len(users) // args.accounts_per_worker)
+    shards = shard_users(users, max(1, workers))
+
+    # The workers log to .worker{index} files, the coordinator to the configured one
+    log_config = fleet_config['logging']
+    secrets = [u['password'] for u in users] + [fleet_config['telegram']['bot_token']]
+    log_pipeline.setup(log_config['level'], log_config['file'], log_config['console_level'], log_config['max_mb'] * 2**20, secrets)
+    atexit.register(log_pipeline.shutdown)
+
+    telegram = fleet_config['telegram']
+    notifier = TelegramNotifier(telegram['bot_token'], telegram.get('api_url') or TELEGRAM_API).start()
+    atexit.register(notifier.flush)
+    thread_id = telegram['message_thread_id']
+
+    results = multiprocessing.Queue()
+    processes = [start_worker(i, fleet_config, shard, results) for i, shard in enumerate(shards)]
+    view = AvailabilityView()
+    while True:
+        try:
+            email, country_code, appointments = results.get(timeout=30)
+        except queue.Empty:
+            email = None
+        if email is not None:
+            changes = view.update(country_code, appointments)
+            if changes:
+                log.info(f"{country_code} (seen by {email}): {changes}")
+                notifier.send(telegram['chat_id'], json.dumps({country_code: changes}, sort_keys=True), thread_id)
+        for i, process in enumerate(processes):
+            if not process.is_alive():
+                log.warning(f"Worker {i} exited with {process.exitcode}, restarting")
+                processes[i] = start_worker(i, fleet_config, shards[i], results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import bisect
+from datetime import date, datetime
+
+
+def iso(value):
+    # date/datetime/"YYYY-MM-DD..." -> "YYYY-MM-DD"; ISO strings sort like dates
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value).strip()[:10]
+
+
+def parse_windows(text):
+    # "2024-01-01:2024-02-01, 2024-03-01:2024-04-01" -> [(start, end), ...]
+    windows = []
+    for item in (text or "").split(","):
+        if item.strip():
+            start, end = item.split(":")
+            windows.append((iso(start), iso(end)))
+    return windows
+
+
+def parse_dates(text):
+    return [iso(item) for item in (text or "").split(",") if item.strip()]
+
+
+def date_key(d):
+    return d.get('date')
+
+
+class DateWindow:
+    # Target period(s) parsed once. Bounds are exclusive like the original
+    # is_in_period(); the days feed is sorted, so each window starts with a
+    # bisect instead of a strptime per entry.
+    def __init__(self, windows, blackout=()):
+        merged = []
+        for start, end in sorted((iso(s), iso(e)) for s, e in windows):
+            if merged and start < merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        self.windows = merged
+        self.blackout = frozenset(iso(d) for d in blackout)
+
+    def candidates(self, dates, before=None):
+        # Yields in-window dates in ascending order, earlier than `before` if given
+        before = iso(before) if before else None
+        for start, end in self.windows:
+            if before and before < end:
+                end = before
+            i = bisect.bisect_right(dates, start, key=date_key)
+            while i < len(dates):
+                d = dates[i].get('date')
+                if d >= end:
+                    break
+                if d not in self.blackout:
+                    yield d
+                i += 1
+
+    def __str__(self):
+        return ", ".join(f"({start}) and ({end})" for start, end in self.windows)
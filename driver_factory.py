@@ -0,0 +1,76 @@
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+# chromedriver location resolved by webdriver_manager, reused across runs so a
+# restart doesn't check versions / download again
+CACHE_FILE = ".chromedriver.json"
+
+_warm_up = None
+# Valid cached chromedriver found by the warm up, None: not checked / not cached
+_cached_path = None
+
+
+def _read_cache():
+    try:
+        with open(CACHE_FILE) as f:
+            path = json.load(f)["path"]
+    except (OSError, ValueError, KeyError):
+        return None
+    return path if os.path.isfile(path) and os.access(path, os.X_OK) else None
+
+
+def chromedriver_path(refresh=False):
+    global _cached_path
+    path = None if refresh else _cached_path or _read_cache()
+    if path is None:
+        from webdriver_manager.chrome import ChromeDriverManager
+        path = ChromeDriverManager().install()
+        with open(CACHE_FILE, "w") as f:
+            json.dump({"path": path}, f)
+    _cached_path = path
+    return path
+
+
+def _prepare():
+    global _cached_path
+    try:
+        import selenium.webdriver  # noqa: F401 (the slow part of startup)
+        # Whether Chrome runs locally is only known from the config: check the
+        # cached chromedriver now, resolve a missing one on the first new_driver()
+        _cached_path = _read_cache()
+    except Exception:
+        log.exception("Preparing the browser failed")
+
+
+def warm_up():
+    # Imports Selenium and checks the cached chromedriver in the background
+    # while the caller parses its config; new_driver() waits for it
+    global _warm_up
+    if _warm_up is None:
+        _warm_up = threading.Thread(target=_prepare, name="driver-warm-up", daemon=True)
+        _warm_up.start()
+
+
+def new_driver(local_use, hub_address=None):
+    if _warm_up is not None:
+        _warm_up.join()
+    from selenium import webdriver
+    if not local_use:
+        return webdriver.Remote(command_executor=hub_address, options=webdriver.ChromeOptions())
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--disable-extensions")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--no-sandbox")
+    try:
+        return webdriver.Chrome(service=Service(chromedriver_path()), options=options)
+    except Exception:
+        # Chrome was probably updated past the cached chromedriver
+        log.warning("Starting Chrome with the cached chromedriver failed, resolving it again")
+        return webdriver.Chrome(service=Service(chromedriver_path(refresh=True)), options=options)
@@ -0,0 +1,139 @@
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+SESSION_COOKIE = "_yatri_session"
+
+
+def is_alive(driver):
+    # Browser still answers and still holds a login cookie
+    try:
+        driver.current_url
+        return driver.get_cookie(SESSION_COOKIE) is not None
+    except Exception:
+        return False
+
+
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception:
+        log.exception("Quitting a browser failed")
+
+
+class DriverPool:
+    # Keeps `size` browsers launched and logged in on standby so a signed out
+    # or crashed session is replaced in milliseconds instead of a full login.
+    # create_driver() -> new WebDriver, login(driver) -> logs it in (blocking).
+    def __init__(self, create_driver, login, size=1, check_interval=60, max_idle=20 * 60, health_check=is_alive):
+        self.create_driver = create_driver
+        self.login = login
+        self.size = size
+        self.check_interval = check_interval
+        self.max_idle = max_idle
+        self.health_check = health_check
+        self.standby = queue.Queue()
+        self.launching = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.active = threading.Event()
+        self.stopped = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is None and self.size > 0:
+            self.active.set()
+            self.thread = threading.Thread(target=self._run, name="driver-pool", daemon=True)
+            self.thread.start()
+
+    def _new_session(self):
+        driver = self.create_driver()
+        try:
+            self.login(driver)
+        except Exception:
+            quit_driver(driver)
+            raise
+        return driver
+
+    def _launch(self):
+        try:
+            driver = self._new_session()
+            self.standby.put((time.time(), driver))
+        except Exception:
+            log.exception("Driver pool: failed to warm up a browser")
+            time.sleep(self.check_interval)
+        finally:
+            with self.lock:
+                self.launching -= 1
+
+    def _check_standby(self):
+        # Drop standby browsers that died or idled long enough to be signed out
+        for _ in range(self.standby.qsize()):
+            try:
+                started, driver = self.standby.get_nowait()
+            except queue.Empty:
+                break
+            if time.time() - started < self.max_idle and self.health_check(driver):
+                self.standby.put((started, driver))
+            else:
+                log.info("Driver pool: recycling a stale standby browser")
+                quit_driver(driver)
+
+    def _run(self):
+        last_check = time.time()
+        while not self.stopped:
+            self.active.wait()
+            if time.time() - last_check > self.check_interval:
+                self._check_standby()
+                last_check = time.time()
+            with self.lock:
+                missing = self.size - self.standby.qsize() - self.launching
+                if missing > 0:
+                    self.launching += 1
+            if missing > 0:
+                self._launch()
+            else:
+                self.wakeup.wait(self.check_interval)
+                self.wakeup.clear()
+
+    def acquire(self, timeout=120):
+        # Returns a logged in driver; logs one in synchronously if none is ready
+        self.active.set()
+        self.wakeup.set()
+        deadline = None if timeout is None else time.time() + timeout
+        while self.size > 0 and self.thread is not None:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                _, driver = self.standby.get(timeout=remaining)
+            except queue.Empty:
+                break
+            self.wakeup.set()
+            if self.health_check(driver):
+                return driver
+            quit_driver(driver)
+        return self._new_session()
+
+    def discard(self, driver):
+        if driver is not None:
+            threading.Thread(target=quit_driver, args=(driver,), daemon=True).start()
+
+    def suspend(self):
+        # Cooling down: stop warming browsers and close the standby ones
+        self.active.clear()
+        while True:
+            try:
+                _, driver = self.standby.get_nowait()
+            except queue.Empty:
+                break
+            quit_driver(driver)
+
+    def close(self):
+        self.stopped = True
+        self.active.set()
+        self.wakeup.set()
+        self.suspend()
@@ -0,0 +1,55 @@
+import time
+
+from pages import form_fields
+
+FORM_FIELDS = ("utf8", "authenticity_token", "confirmed_limit_message", "use_consulate_appointment_capacity")
+
+
+class AppointmentForm:
+    # Hidden fields of the reschedule form, fetched while idle so booking a
+    # detected date is just the time lookup and one POST.
+    def __init__(self, url, max_age=10 * 60):
+        self.url = url
+        self.max_age = max_age
+        self.fields = None
+        self.fetched = 0
+
+    def is_stale(self):
+        # Refresh a bit before the token could expire
+        return self.fields is None or time.time() - self.fetched > self.max_age * 0.8
+
+    def refresh(self, session):
+        fields = form_fields(session.get_html(self.url))
+        missing = [name for name in FORM_FIELDS if name not in fields]
+        if missing:
+            raise ValueError(f"Appointment form without {missing}")
+        self.fields = {name: fields[name] for name in FORM_FIELDS}
+        self.fetched = time.time()
+        return self.fields
+
+    def get(self, session):
+        return self.refresh(session) if self.is_stale() else self.fields
+
+    def invalidate(self):
+        self.fields = None
+
+
+class StageTimer:
+    # Wall time of each stage from `start` (default: now), e.g. detection -> booked
+    def __init__(self, start=None):
+        self.start = start if start is not None else time.perf_counter()
+        self.last = self.start
+        self.stages = []
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    @property
+    def total(self):
+        return self.last - self.start
+
+    def __str__(self):
+        stages = ", ".join(f"{stage}: {t * 1000:.0f}ms" for stage, t in self.stages)
+        return f"{self.total * 1000:.0f}ms ({stages})"
@@ -0,0 +1,137 @@
+import argparse
+import fcntl
+import json
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+# timestamp, facility_id, account index, number of dates; followed by the
+# dates as uint32 ordinals. One segment file per UTC day is the time index.
+HEADER = struct.Struct("<dIHH")
+ACCOUNTS_FILE = "accounts.json"
+
+
+def segment_name(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d") + ".bin"
+
+
+class HistoryStore:
+    # Append-only store of every poll result. Writes are buffered and flushed
+    # in batches instead of one open/close per line.
+    def __init__(self, path="history", batch_size=100, flush_interval=60):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.buffer = {}
+        self.pending = 0
+        self.last_flush = time.time()
+        os.makedirs(path, exist_ok=True)
+        self.accounts = self._read_accounts()
+
+    def _read_accounts(self):
+        try:
+            with open(os.path.join(self.path, ACCOUNTS_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def account_index(self, account):
+        # Several processes can share the directory: new accounts are added to
+        # what is on disk under a file lock, so no two get the same index
+        if account not in self.accounts:
+            accounts_path = os.path.join(self.path, ACCOUNTS_FILE)
+            with open(accounts_path + ".lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    accounts = self._read_accounts()
+                    if account not in accounts:
+                        accounts.append(account)
+                        with open(accounts_path + ".tmp", "w") as f:
+                            json.dump(accounts, f)
+                        os.replace(accounts_path + ".tmp", accounts_path)
+                    self.accounts = accounts
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        return self.accounts.index(account)
+
+    def append(self, account, facility_id, dates, ts=None):
+        # dates: ISO strings (or date objects) returned by the days feed
+        ts = time.time() if ts is None else ts
+        ordinals = array("I", (date.fromisoformat(str(d)[:10]).toordinal() for d in dates))
+        record = HEADER.pack(ts, int(facility_id), self.account_index(account), len(ordinals)) + ordinals.tobytes()
+        with self.lock:
+            self.buffer.setdefault(segment_name(ts), []).append(record)
+            self.pending += 1
+            if self.pending >= self.batch_size or time.time() - self.last_flush > self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        for name, records in self.buffer.items():
+            with open(os.path.join(self.path, name), "ab") as f:
+                f.write(b"".join(records))
+        self.buffer = {}
+        self.pending = 0
+        self.last_flush = time.time()
+
+    def segments(self, start=None, end=None):
+        names = sorted(n for n in os.listdir(self.path) if n.endswith(".bin"))
+        if start is not None:
+            names = [n for n in names if n >= segment_name(start)]
+        if end is not None:
+            names = [n for n in names if n <= segment_name(end)]
+        return [os.path.join(self.path, n) for n in names]
+
+    def records(self, start=None, end=None, facility_id=None):
+        # Yields (timestamp, facility_id, account, [date ordinals]) in write order
+        self.flush()
+        # Other processes may have added accounts since
+        accounts = self.accounts = self._read_accounts()
+        for segment in self.segments(start, end):
+            with open(segment, "rb") as f:
+                data = f.read()
+            offset = 0
+            while offset < len(data):
+                ts, facility, account, n = HEADER.unpack_from(data, offset)
+                offset += HEADER.size
+                if (facility_id is None or facility == facility_id) and (start is None or ts >= start) and (end is None or ts <= end):
+                    ordinals = array("I")
+                    ordinals.frombytes(data[offset:offset + 4 * n])
+                    yield ts, facility, accounts[account], ordinals
+                offset += 4 * n
+
+    def release_hours(self, facility_id, start=None, end=None):
+        # Hour of day (UTC) -> how many times new dates appeared for the facility
+        hours = Counter()
+        previous = None
+        for ts, _, _, ordinals in self.records(start, end, facility_id):
+            current = set(ordinals)
+            if previous is not None and current - previous:
+                hours[datetime.fromtimestamp(ts, timezone.utc).hour] += 1
+            previous = current
+        return hours
+
+    def close(self):
+        self.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="When do slots usually appear?")
+    parser.add_argument('path', nargs='?', default='history')
+    parser.add_argument('--facility', type=int, required=True)
+    parser.add_argument('--days', type=int, default=90)
+    args = parser.parse_args()
+
+    store = HistoryStore(args.path)
+    since = (datetime.now(timezone.utc) - timedelta(days=args.days)).timestamp()
+    hours = store.release_hours(args.facility, start=since)
+    for hour in range(24):
+        print(f"{hour:02d}:00 UTC  {'#' * hours[hour]} {hours[hour]}")
@@ -0,0 +1,70 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+SESSION_COOKIE = "_yatri_session"
+# (connect, read) timeouts in seconds for the plain HTTP calls
+TIMEOUT = (5, 20)
+# Overrides the XHR headers for full page requests
+HTML_HEADERS = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "X-Requested-With": None,
+}
+
+
+class SessionExpired(Exception):
+    pass
+
+
+class YatriSession:
+    # Browserless client for the ais.usvisa-info.com JSON endpoints.
+    # Selenium is only needed to log in; afterwards the session cookie and the
+    # browser's user agent are replayed over a pooled keep-alive connection.
+    def __init__(self, session_cookie, user_agent, referer=None, pool_size=4):
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        self.http.headers.update({
+            "User-Agent": user_agent,
+            "Accept": "application/json, text/javascript, */*; q=0.01",
+            "X-Requested-With": "XMLHttpRequest",
+        })
+        if referer:
+            self.http.headers["Referer"] = referer
+        self.http.cookies.set(SESSION_COOKIE, session_cookie)
+
+    @classmethod
+    def from_driver(cls, driver, referer=None):
+        cookie = driver.get_cookie(SESSION_COOKIE)
+        if not cookie:
+            raise SessionExpired("No session cookie in the browser")
+        user_agent = driver.execute_script("return navigator.userAgent;")
+        return cls(cookie["value"], user_agent, referer)
+
+    @property
+    def session_cookie(self):
+        return self.http.cookies.get(SESSION_COOKIE)
+
+    def get_json_text(self, url):
+        # The site answers an expired session with a redirect to sign_in or 401
+        r = self.http.get(url, timeout=TIMEOUT, allow_redirects=False)
+        if r.is_redirect or r.status_code in (401, 403):
+            raise SessionExpired(f"{r.status_code} from {url}")
+        r.raise_for_status()
+        if "json" not in r.headers.get("Content-Type", ""):
+            raise SessionExpired(f"Non JSON response from {url}")
+        return r.text
+
+    def get_html(self, url):
+        r = self.http.get(url, headers=HTML_HEADERS, timeout=TIMEOUT, allow_redirects=False)
+        if r.is_redirect or r.status_code in (401, 403):
+            raise SessionExpired(f"{r.status_code} from {url}")
+        r.raise_for_status()
+        return r.text
+
+    def post_form(self, url, data):
+        # Same keep-alive connection and cookie jar as the polls
+        return self.http.post(url, data=data, headers={**HTML_HEADERS, "Referer": url}, timeout=TIMEOUT)
+
+    def close(self):
+        self.http.close()
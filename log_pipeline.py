@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler
+
+# Values that must never reach a log line; literal secrets (passwords, bot
+# token) are added by setup()
+SECRET_PATTERNS = [
+    re.compile(r"(_yatri_session['\"]?\s*[=:]\s*['\"]?)[^'\";,\s}]+"),
+    re.compile(r"(['\"]?(?:value|password|authenticity_token|bot_token)['\"]?\s*[=:]\s*['\"]?)[^'\";,\s}]+", re.I),
+    re.compile(r"(bot)\d+:[\w-]+"),
+]
+STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class Redactor:
+    def __init__(self, secrets=()):
+        self.secrets = [s for s in map(str, secrets) if len(s) >= 4]
+
+    def __call__(self, text):
+        for secret in self.secrets:
+            text = text.replace(secret, "***")
+        for pattern in SECRET_PATTERNS:
+            text = pattern.sub(r"\1***", text)
+        return text
+
+
+class JsonLinesWriter(threading.Thread):
+    # Formats and writes log records off the poll thread: records are taken
+    # from the queue in batches, written as JSON lines with one flush per batch,
+    # and the file rotates daily (the {date} in the name) or past max_bytes.
+    def __init__(self, records, path="log_{date}.jsonl", max_bytes=50 * 2**20, backups=5,
+                 batch_size=200, flush_interval=2.0, redact=None, console_level=logging.INFO):
+        super().__init__(name="log-writer", daemon=True)
+        self.records = records
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.redact = redact or Redactor()
+        self.console_level = console_level
+        self.file = None
+        self.file_name = None
+
+    def _open(self):
+        name = self.path.format(date=datetime.now().date())
+        if name != self.file_name:
+            if self.file:
+                self.file.close()
+            self.file_name = name
+            self.file = open(name, "a", buffering=2**16)
+        elif self.max_bytes and self.file.tell() > self.max_bytes:
+            self.file.close()
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{name}.{i}"):
+                    os.replace(f"{name}.{i}", f"{name}.{i + 1}")
+            os.replace(name, f"{name}.1")
+            self.file = open(name, "a", buffering=2**16)
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in STANDARD_ATTRS})
+        if record.exc_info:
+            entry["exc"] = logging.Formatter().formatException(record.exc_info)
+        return self.redact(json.dumps(entry, default=str, ensure_ascii=False))
+
+    def write(self, batch):
+        if self.path:
+            self._open()
+            self.file.write("".join(self.format(r) + "\n" for r in batch))
+            self.file.flush()
+        console = [r for r in batch if r.levelno >= self.console_level]
+        if console:
+            sys.stdout.write("".join(f"{r.levelname[0]} {self.redact(r.getMessage())}\n" for r in console))
+            sys.stdout.flush()
+
+    def run(self):
+        while True:
+            batch = [self.records.get()]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get(timeout=max(0, deadline - time.time())))
+                except queue.Empty:
+                    break
+            stop = None in batch
+            try:
+                self.write([r for r in batch if r is not None])
+            except Exception:
+                # Logging must never take the bot down
+                pass
+            if stop:
+                return
+
+
+class DroppingQueueHandler(QueueHandler):
+    # A full queue drops the record instead of blocking the poll loop
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+    def prepare(self, record):
+        # Formatting happens in the writer thread; only resolve args here
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_writer = None
+
+
+def setup(level="INFO", path="log_{date}.jsonl", console_level="INFO", max_bytes=50 * 2**20, secrets=(), max_queue=10000):
+    # Routes the root logger through the background JSON-lines writer
+    global _writer
+    # A forked worker process inherits _writer but not its thread: it starts its own
+    if _writer is not None and _writer.pid == os.getpid():
+        return logging.getLogger()
+    records = queue.Queue(maxsize=max_queue)
+    _writer = JsonLinesWriter(records, path, max_bytes, redact=Redactor(secrets),
+                              console_level=logging.getLevelName(console_level.upper()))
+    _writer.pid = os.getpid()
+    _writer.start()
+    root = logging.getLogger()
+    root.handlers[:] = [DroppingQueueHandler(records)]
+    root.setLevel(level.upper())
+    return root
+
+
+def shutdown(timeout=5):
+    # Flushes what is queued; registered with atexit by the scripts
+    if _writer is not None and _writer.pid == os.getpid():
+        try:
+            _writer.records.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        _writer.join(timeout)
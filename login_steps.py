@@ -0,0 +1,66 @@
+import logging
+import time
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+# Selenium locator strategies (the values of selenium's By constants), so this
+# module can be imported without loading Selenium
+LOCATORS = {"id": "id", "name": "name", "class": "class name", "xpath": "xpath"}
+
+# ready: "clickable" or "present", what the element must be before the action
+# done: optional check(driver) that proves the action took effect
+Step = namedtuple("Step", ["label", "find_by", "locator", "action", "value", "ready", "done"], defaults=[None, None, "clickable", None])
+
+
+def value_is(find_by, locator, value):
+    def check(driver):
+        return driver.find_element(LOCATORS[find_by], locator).get_attribute("value") == value
+    return check
+
+
+def checkbox_checked(find_by, locator):
+    # The privacy checkbox is an iCheck widget: the div gets a "checked" class
+    def check(driver):
+        element = driver.find_element(LOCATORS[find_by], locator)
+        return "checked" in (element.get_attribute("class") or "").split() or element.is_selected()
+    return check
+
+
+def login_steps(email, password, continue_text):
+    return [
+        Step("Sign in form", "name", "commit", ready="present"),
+        Step("Click bounce", "xpath", '//a[@class="down-arrow bounce"]', "click"),
+        Step("Email", "id", "user_email", "send", email, done=value_is("id", "user_email", email)),
+        Step("Password", "id", "user_password", "send", password, done=value_is("id", "user_password", password)),
+        Step("Privacy", "class", "icheckbox", "click", done=checkbox_checked("class", "icheckbox")),
+        Step("Enter Panel", "name", "commit", "click"),
+        Step("Logged in", "xpath", f"//a[contains(text(), '{continue_text}')]", ready="present"),
+    ]
+
+
+def run_steps(driver, steps, timeout=60):
+    # Each step moves on as soon as its condition holds; returns [(label, seconds)]
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait as Wait
+    conditions = {"clickable": EC.element_to_be_clickable, "present": EC.presence_of_element_located}
+    timings = []
+    for step in steps:
+        t0 = time.perf_counter()
+        item = Wait(driver, timeout).until(conditions[step.ready]((LOCATORS[step.find_by], step.locator)))
+        match step.action:
+            case "send":
+                item.send_keys(step.value)
+            case "click":
+                item.click()
+        if step.done:
+            Wait(driver, timeout).until(step.done)
+        timings.append((step.label, time.perf_counter() - t0))
+        log.debug(f"{step.label}: done in {timings[-1][1]:.1f}s")
+    return timings
+
+
+def format_timings(timings):
+    total = sum(t for _, t in timings)
+    steps = ", ".join(f"{label}: {t:.2f}s" for label, t in timings)
+    return f"Login took {total:.2f}s ({steps})"
@@ -0,0 +1,121 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+lock = threading.Lock()
+counters = {}
+histograms = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with lock:
+        h = histograms.get(key)
+        if h is None:
+            h = histograms[key] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                h["buckets"][i] += 1
+        h["sum"] += seconds
+        h["count"] += 1
+
+
+@contextmanager
+def timed(name, **labels):
+    # Observes the duration into `name`_seconds, also when the block raises
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+
+def _labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def prometheus_text():
+    lines = []
+    with lock:
+        for (name, labels), value in sorted(counters.items()):
+            lines.append(f"visa_{name}_total{_labels(labels)} {value}")
+        for (name, labels), h in sorted(histograms.items()):
+            for bound, count in zip(BUCKETS, h["buckets"]):
+                le = "+Inf" if bound == float("inf") else bound
+                lines.append(f"visa_{name}_seconds_bucket{_labels(labels, [('le', le)])} {count}")
+            lines.append(f"visa_{name}_seconds_sum{_labels(labels)} {h['sum']:.6f}")
+            lines.append(f"visa_{name}_seconds_count{_labels(labels)} {h['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    with lock:
+        return {
+            "time": time.time(),
+            "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in counters.items()],
+            "histograms": [
+                {"name": n, "labels": dict(l), "count": h["count"], "sum": h["sum"],
+                 "buckets": dict(zip(map(str, BUCKETS), h["buckets"]))}
+                for (n, l), h in histograms.items()
+            ],
+        }
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body, content_type = json.dumps(snapshot()).encode(), "application/json"
+        elif self.path.startswith("/metrics"):
+            body, content_type = prometheus_text().encode(), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    # Prometheus endpoint on http://host:port/metrics (JSON on /metrics.json)
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def dump_periodically(path, interval=60):
+    def run():
+        while True:
+            time.sleep(interval)
+            with open(path, "w") as f:
+                json.dump(snapshot(), f)
+    threading.Thread(target=run, name="metrics-dump", daemon=True).start()
+
+
+def start(port=0, json_file="", interval=60):
+    if port:
+        serve(port)
+    if json_file:
+        dump_periodically(json_file, interval)
@@ -0,0 +1,120 @@
+import logging
+import queue
+import threading
+import time
+
+import requests
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+TELEGRAM_API = "https://api.telegram.org"
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TelegramNotifier:
+    # Sends notifications from a background thread so the poll loop never
+    # waits on Telegram. Messages queued for the same chat/thread while a send
+    # is in progress are merged into one message; 429 answers are honoured
+    # with their retry_after, other failures back off exponentially.
+    def __init__(self, bot_token, api_url=TELEGRAM_API, max_queue=100, batch_window=1.0, max_retries=5, timeout=(5, 15)):
+        self.url = f"{api_url.rstrip('/')}/bot{bot_token}/sendMessage"
+        self.enabled = bool(bot_token)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_window = batch_window
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.http = requests.Session()
+        self.dropped = 0
+        self.thread = None
+
+    def start(self):
+        if self.thread is None and self.enabled:
+            self.thread = threading.Thread(target=self._run, name="telegram-notifier", daemon=True)
+            self.thread.start()
+        return self
+
+    def send(self, chat_id, text, thread_id=None):
+        # Never blocks: when the queue is full the message is dropped
+        if not self.enabled:
+            return False
+        self.start()
+        try:
+            self.queue.put_nowait((chat_id, thread_id, text))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            log.warning(f"Notification queue full, dropped {self.dropped} messages so far")
+            return False
+
+    def _collect(self):
+        # Blocks for the first message, then gathers what arrives within batch_window
+        batches = {}
+        item = self.queue.get()
+        deadline = time.time() + self.batch_window
+        while item is not None:
+            chat_id, thread_id, text = item
+            batches.setdefault((chat_id, thread_id), []).append(text)
+            remaining = deadline - time.time()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                item = None
+        return batches
+
+    def _run(self):
+        while True:
+            batches = self._collect()
+            for (chat_id, thread_id), texts in batches.items():
+                for text in split_messages(texts):
+                    self._post(chat_id, thread_id, text)
+            # Marked done only once sent, so flush() also waits for the batch in flight
+            for _ in range(sum(len(texts) for texts in batches.values())):
+                self.queue.task_done()
+
+    def _post(self, chat_id, thread_id, text):
+        data = {'chat_id': chat_id, 'text': text}
+        if thread_id:
+            data['message_thread_id'] = thread_id
+        delay = 1
+        for _ in range(self.max_retries):
+            try:
+                with metrics.timed("telegram_send"):
+                    r = self.http.post(self.url, data=data, timeout=self.timeout)
+                if r.status_code == 429:
+                    delay = r.json().get('parameters', {}).get('retry_after', delay)
+                elif r.status_code < 500:
+                    if not r.ok:
+                        log.warning(f"Telegram rejected the notification: {r.status_code} {r.text}")
+                    metrics.inc("telegram_messages", result="sent" if r.ok else "rejected")
+                    return r.ok
+            except requests.RequestException:
+                log.exception("Sending the notification failed")
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+        log.error(f"Giving up on notification after {self.max_retries} attempts")
+        metrics.inc("telegram_messages", result="failed")
+        return False
+
+    def flush(self, timeout=10):
+        # Waits (bounded) until queued messages were sent; registered with atexit
+        deadline = time.time() + timeout
+        while self.thread is not None and self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.1)
+
+
+def split_messages(texts):
+    # Joins texts into as few messages as fit Telegram's length limit
+    messages = []
+    current = ""
+    for text in texts:
+        text = text[:MAX_MESSAGE_LENGTH]
+        if current and len(current) + 2 + len(text) > MAX_MESSAGE_LENGTH:
+            messages.append(current)
+            current = ""
+        current = f"{current}\n\n{text}" if current else text
+    if current:
+        messages.append(current)
+    return messages
@@ -0,0 +1,65 @@
+from html.parser import HTMLParser
+
+
+class InputCollector(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.fields = {}
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "input":
+            attrs = dict(attrs)
+            if attrs.get("name") and attrs["name"] not in self.fields:
+                self.fields[attrs["name"]] = attrs.get("value") or ""
+
+
+def form_fields(html):
+    # name -> value of every <input> on the page (first one wins)
+    parser = InputCollector()
+    parser.feed(html)
+    return parser.fields
+
+
+class PaymentTableParser(HTMLParser):
+    # Rows of the table inside #paymentOptions, as lists of cell texts
+    def __init__(self):
+        super().__init__()
+        self.container = None
+        self.depth = 0
+        self.rows = []
+        self.cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.container is None:
+            if dict(attrs).get("id") == "paymentOptions":
+                self.container = tag
+                self.depth = 1
+            return
+        if self.depth == 0:
+            return
+        if tag == self.container:
+            self.depth += 1
+        elif tag == "tr":
+            self.rows.append([])
+        elif tag == "td" and self.rows:
+            self.cell = []
+
+    def handle_endtag(self, tag):
+        if self.container is None or self.depth == 0:
+            return
+        if tag == self.container:
+            self.depth -= 1
+        elif tag == "td" and self.cell is not None:
+            self.rows[-1].append(" ".join("".join(self.cell).split()))
+            self.cell = None
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+
+
+def payment_table(html):
+    # location -> first available appointment, for every row of the table
+    parser = PaymentTableParser()
+    parser.feed(html)
+    return {row[0]: row[1] for row in parser.rows if len(row) >= 2 and row[0]}
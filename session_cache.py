@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+log = logging.getLogger(__name__)
+
+# Cookie attributes WebDriver accepts in add_cookie()
+COOKIE_KEYS = ("name", "value", "path", "domain", "secure", "httpOnly", "expiry", "sameSite")
+
+
+class SessionCache:
+    # Login cookies per account, persisted across restarts and cooldowns.
+    # A cached session is checked with one request before it is put back into
+    # a browser; only when that fails does the caller log in from scratch.
+    def __init__(self, path="sessions.json", max_age=2 * 60 * 60):
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.sessions = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.sessions = json.load(f)
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            json.dump(self.sessions, f)
+        os.replace(tmp, self.path)
+
+    def save(self, account, driver):
+        cookies = [{k: c[k] for k in COOKIE_KEYS if k in c} for c in driver.get_cookies()]
+        user_agent = driver.execute_script("return navigator.userAgent;")
+        expiries = [c["expiry"] for c in cookies if c.get("expiry")]
+        expires = min([time.time() + self.max_age] + expiries)
+        with self.lock:
+            self.sessions[account] = {"cookies": cookies, "user_agent": user_agent, "expires": expires}
+            self._save()
+
+    def remember(self, account, name, value):
+        # Keep the cookie the site rotated during HTTP polling
+        with self.lock:
+            entry = self.sessions.get(account)
+            if not entry or not value:
+                return
+            for cookie in entry["cookies"]:
+                if cookie["name"] == name and cookie["value"] != value:
+                    cookie["value"] = value
+                    self._save()
+
+    def invalidate(self, account):
+        with self.lock:
+            if self.sessions.pop(account, None) is not None:
+                self._save()
+
+    def load(self, account):
+        entry = self.sessions.get(account)
+        if entry is None or entry["expires"] < time.time():
+            return None
+        return entry
+
+    def validate(self, account, url):
+        # One request with the cached cookies; returns the (possibly rotated) cookies
+        entry = self.load(account)
+        if entry is None:
+            return None
+        http = requests.Session()
+        http.headers["User-Agent"] = entry["user_agent"]
+        for cookie in entry["cookies"]:
+            http.cookies.set(cookie["name"], cookie["value"])
+        try:
+            r = http.get(url, timeout=(5, 15), allow_redirects=False)
+        except requests.RequestException:
+            return None
+        finally:
+            http.close()
+        if r.status_code != 200:
+            self.invalidate(account)
+            return None
+        rotated = http.cookies.get_dict()
+        return [dict(c, value=rotated.get(c["name"], c["value"])) for c in entry["cookies"]]
+
+    def restore(self, account, driver, validate_url, site_url):
+        # True when the browser is logged in again without the sign in form
+        cookies = self.validate(account, validate_url)
+        if cookies is None:
+            return False
+        # Cookies can only be set for the site the browser is on
+        driver.get(f"{site_url.rstrip('/')}/robots.txt")
+        for cookie in cookies:
+            driver.add_cookie(cookie)
+        log.info(f"Restored the cached session of {account}")
+        return True
@@ -0,0 +1,290 @@
+import configparser
+import logging
+import os
+from datetime import date
+
+import yaml
+
+from date_window import iso, parse_windows, parse_dates
+from embassy import Embassies
+from notifier import TELEGRAM_API
+from slot_selection import parse_hours
+
+log = logging.getLogger("settings")
+
+REQUIRED = object()
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def boolean(value):
+    if isinstance(value, str):
+        if value.strip().lower() not in ("1", "0", "true", "false", "yes", "no", "on", "off"):
+            raise ValueError(f"not a boolean: {value!r}")
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def text(value):
+    return iso(value) if isinstance(value, date) else str(value)
+
+
+# Both scripts read this shape, whatever the file format: key -> (type, default),
+# a nested dict is a section and a one-item list a list of such sections.
+SCHEMA = {
+    'users': [{
+        'email': (text, REQUIRED),
+        'password': (text, REQUIRED),
+        'schedule_id': (text, REQUIRED),
+        'group_id': (text, REQUIRED),
+    }],
+    'embassies': [{
+        'country_code': (text, REQUIRED),
+        'facility_id': (int, REQUIRED),
+        'continue': (text, 'Continue'),
+    }],
+    'period_start': (text, ''),
+    'period_end': (text, ''),
+    'preferred_windows': (text, ''),
+    'blackout_dates': (text, ''),
+    'top_dates': (int, 3),
+    'preferred_hours': (text, ''),
+    'base_url': (text, 'https://ais.usvisa-info.com'),
+    'history_dir': (text, 'history'),
+    'account_health_file': (text, 'account_health.json'),
+    'session_file': (text, 'sessions.json'),
+    'chrome_driver': {
+        'local_use': (boolean, True),
+        'hub_address': (text, ''),
+        'http_polling': (boolean, True),
+        'pool_size': (int, 1),
+    },
+    'telegram': {
+        'bot_token': (text, ''),
+        'chat_id': (text, ''),
+        'message_thread_id': (text, ''),
+        'api_url': (text, TELEGRAM_API),
+    },
+    'availability_cache': {
+        'dir': (text, 'availability_cache'),
+        'ttl': (float, 5),
+    },
+    'metrics': {
+        'port': (int, 0),
+        'json_file': (text, ''),
+    },
+    'logging': {
+        'level': (text, 'INFO'),
+        'console_level': (text, 'INFO'),
+        'file': (text, 'log_{date}.jsonl'),
+        'max_mb': (float, 50),
+    },
+    'time': {
+        'retry_lower_bound': (float, REQUIRED),
+        'retry_upper_bound': (float, REQUIRED),
+        'work_limit_hours': (float, REQUIRED),
+        'work_cooldown_hours': (float, REQUIRED),
+        'ban_cooldown_hours': (float, REQUIRED),
+        'request_budget': (int, 0),
+    },
+}
+
+# Old or misspelled keys still accepted: (section or None, alias) -> key
+ALIASES = {
+    (None, 'perido_end'): 'period_end',
+    ('telegram', 'thread_id'): 'message_thread_id',
+}
+
+
+def ini_to_dict(parser):
+    # config.ini (one account, embassy from embassy.py) in the YAML layout
+    def get(section, key, fallback=None):
+        return parser.get(section, key, fallback=fallback)
+
+    personal = parser['PERSONAL_INFO'] if parser.has_section('PERSONAL_INFO') else {}
+    return {
+        'users': [{
+            'email': personal.get('USERNAME'),
+            'password': personal.get('PASSWORD'),
+            'schedule_id': personal.get('SCHEDULE_ID'),
+            'group_id': personal.get('GROUP_ID'),
+        }],
+        'embassies': [{'embassy': personal.get('YOUR_EMBASSY')}],
+        'period_start': personal.get('PRIOD_START'),
+        'period_end': personal.get('PRIOD_END'),
+        'preferred_windows': personal.get('PREFERRED_WINDOWS'),
+        'blackout_dates': personal.get('BLACKOUT_DATES'),
+        'top_dates': personal.get('TOP_DATES'),
+        'preferred_hours': personal.get('PREFERRED_HOURS'),
+        'base_url': personal.get('BASE_URL'),
+        'history_dir': get('HISTORY', 'DIR'),
+        'account_health_file': get('HISTORY', 'HEALTH_FILE'),
+        'session_file': get('HISTORY', 'SESSION_FILE'),
+        'chrome_driver': {
+            'local_use': get('CHROMEDRIVER', 'LOCAL_USE'),
+            'hub_address': get('CHROMEDRIVER', 'HUB_ADDRESS'),
+            'http_polling': get('CHROMEDRIVER', 'HTTP_POLLING'),
+            'pool_size': get('CHROMEDRIVER', 'POOL_SIZE'),
+        },
+        'telegram': {
+            'bot_token': get('NOTIFICATION', 'TELEGRAM_BOT_TOKEN'),
+            'chat_id': get('NOTIFICATION', 'TELEGRAM_CHAT_ID'),
+            'message_thread_id': get('NOTIFICATION', 'TELEGRAM_MESSAGE_THREAD_ID'),
+            'api_url': get('NOTIFICATION', 'TELEGRAM_API_URL'),
+        },
+        'availability_cache': {
+            'dir': get('AVAILABILITY_CACHE', 'DIR'),
+            'ttl': get('AVAILABILITY_CACHE', 'TTL'),
+        },
+        'metrics': {
+            'port': get('METRICS', 'PORT'),
+            'json_file': get('METRICS', 'JSON_FILE'),
+        },
+        'logging': {
+            'level': get('LOGGING', 'LEVEL'),
+            'console_level': get('LOGGING', 'CONSOLE_LEVEL'),
+            'file': get('LOGGING', 'FILE'),
+            'max_mb': get('LOGGING', 'MAX_MB'),
+        },
+        'time': {
+            'retry_lower_bound': get('TIME', 'RETRY_TIME_L_BOUND'),
+            'retry_upper_bound': get('TIME', 'RETRY_TIME_U_BOUND'),
+            'work_limit_hours': get('TIME', 'WORK_LIMIT_TIME'),
+            'work_cooldown_hours': get('TIME', 'WORK_COOLDOWN_TIME'),
+            'ban_cooldown_hours': get('TIME', 'BAN_COOLDOWN_TIME'),
+            'request_budget': get('TIME', 'REQUEST_BUDGET'),
+        },
+    }
+
+
+def expand_embassy(entry, errors):
+    # {embassy: en-il-ta} -> country_code/facility_id/continue from embassy.py
+    if not isinstance(entry, dict) or 'embassy' not in entry:
+        return entry
+    entry = dict(entry)
+    name = entry.pop('embassy')
+    if name not in Embassies:
+        errors.append(f"embassies: unknown embassy {name!r} (see embassy.py)")
+        return entry
+    country_code, facility_id, continue_text = Embassies[name]
+    return {'country_code': country_code, 'facility_id': facility_id, 'continue': continue_text, **entry}
+
+
+def check(schema, raw, path, errors):
+    # Fills defaults and converts types; problems are collected in errors
+    if raw is None:
+        raw = {}
+    if not isinstance(raw, dict):
+        errors.append(f"{path or 'config'}: expected a mapping")
+        return {}
+    section = path.split('[')[0] or None
+    raw = {ALIASES.get((section, key), key): value for key, value in raw.items()}
+    result = {}
+    for key, spec in schema.items():
+        name = f"{path}.{key}" if path else key
+        value = raw.get(key)
+        if isinstance(spec, dict):
+            result[key] = check(spec, value, name, errors)
+        elif isinstance(spec, list):
+            items = [expand_embassy(v, errors) for v in value or []] if key == 'embassies' else value or []
+            if not items:
+                errors.append(f"{name}: at least one entry is required")
+            result[key] = [check(spec[0], item, f"{name}[{i}]", errors) for i, item in enumerate(items)]
+        else:
+            convert, default = spec
+            # Empty INI values mean "not set", except for text where "" turns a feature off
+            if value is None or (value == '' and convert is not text):
+                if default is REQUIRED:
+                    errors.append(f"{name}: required")
+                result[key] = None if default is REQUIRED else default
+                continue
+            try:
+                result[key] = convert(value)
+            except (TypeError, ValueError):
+                errors.append(f"{name}: invalid value {value!r}")
+                result[key] = None if default is REQUIRED else default
+            if result[key] == '' and default is REQUIRED:
+                errors.append(f"{name}: required")
+    for key in raw:
+        if key not in schema:
+            log.warning(f"Unknown config key {path + '.' if path else ''}{key}")
+    return result
+
+
+def validate(raw):
+    errors = []
+    config = check(SCHEMA, raw, '', errors)
+    try:
+        windows = parse_windows(config['preferred_windows'])
+        parse_dates(config['blackout_dates'])
+        parse_hours(config['preferred_hours'])
+        for value in [config['period_start'], config['period_end']] + [d for w in windows for d in w]:
+            if value:
+                date.fromisoformat(value)
+    except ValueError as e:
+        errors.append(f"dates/hours: {e}")
+    if config['period_start'] and config['period_end'] and config['period_start'] > config['period_end']:
+        errors.append("period_start is after period_end")
+    if config['time']['retry_lower_bound'] and config['time']['retry_upper_bound']:
+        if config['time']['retry_lower_bound'] > config['time']['retry_upper_bound']:
+            errors.append("time.retry_lower_bound is above time.retry_upper_bound")
+    emails = [u.get('email') for u in config['users']]
+    if len(set(emails)) != len(emails):
+        errors.append("users: the same email is listed twice")
+    if errors:
+        raise ConfigError("; ".join(errors))
+    return config
+
+
+def read(path):
+    # config.ini, config.ini.example, ... are INI, anything else YAML
+    if '.ini' in os.path.basename(path).lower():
+        parser = configparser.ConfigParser()
+        if not parser.read(path):
+            raise ConfigError(f"{path}: not found")
+        return ini_to_dict(parser)
+    with open(path) as f:
+        return yaml.load(f, Loader=yaml.loader.SafeLoader)
+
+
+def load(path):
+    # config.ini or config.yaml -> validated config in the YAML layout
+    try:
+        return validate(read(path))
+    except (OSError, yaml.YAMLError, configparser.Error) as e:
+        raise ConfigError(f"{path}: {e}") from e
+
+
+class ConfigWatcher:
+    # Polled from the scripts' loops: returns the new config after the file
+    # changed, or None. An edit that does not validate is logged and skipped,
+    # so a half-saved file never stops the bot.
+    def __init__(self, path, config):
+        self.path = path
+        self.config = config
+        self.mtime = self._mtime()
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def poll(self):
+        mtime = self._mtime()
+        if mtime is None or mtime == self.mtime:
+            return None
+        self.mtime = mtime
+        try:
+            config = load(self.path)
+        except ConfigError as e:
+            log.error(f"Ignoring the change of {self.path}: {e}")
+            return None
+        changed = sorted(k for k in config if config[k] != self.config.get(k))
+        self.config = config
+        if not changed:
+            return None
+        log.info(f"Reloaded {self.path}: {', '.join(changed)} changed")
+        return config
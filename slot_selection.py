@@ -0,0 +1,64 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+def parse_hours(text):
+    # "8, 9, 14" -> {8, 9, 14}
+    return {int(h) for h in (text or "").split(",") if h.strip()}
+
+
+class SlotSelector:
+    # Fetches the time lists of several candidate dates at once and ranks the
+    # resulting slots, so a failed booking moves straight on to the next one.
+    # fetch_times(facility_id, date) -> ["HH:MM", ...]
+    def __init__(self, fetch_times, preferred_hours=(), facility_priority=(), ttl=20, workers=4):
+        self.fetch_times = fetch_times
+        self.preferred_hours = set(preferred_hours)
+        self.facility_rank = {f: i for i, f in enumerate(facility_priority)}
+        self.ttl = ttl
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.cache = {}
+
+    def times(self, facility_id, date):
+        # Time lists are cached briefly so overlapping lookups share one request
+        key = (facility_id, date)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry and time.time() - entry[0] < self.ttl:
+                return entry[1]
+        times = self.fetch_times(facility_id, date)
+        with self.lock:
+            self.cache[key] = (time.time(), times)
+        return times
+
+    def safe_times(self, facility_id, date):
+        try:
+            return self.times(facility_id, date)
+        except Exception:
+            log.exception(f"Looking up the times of {date} failed")
+            return []
+
+    def invalidate(self, facility_id, date):
+        with self.lock:
+            self.cache.pop((facility_id, date), None)
+
+    def slot_key(self, slot):
+        facility_id, date, slot_time = slot
+        preferred = int(slot_time[:2]) in self.preferred_hours if self.preferred_hours else True
+        # Facility priority, earliest date, preferred hours, then the latest time of the day
+        return self.facility_rank.get(facility_id, len(self.facility_rank)), date, not preferred, [-ord(c) for c in slot_time]
+
+    def rank(self, candidates):
+        # candidates: [(facility_id, date), ...] -> [(facility_id, date, time), ...] best first
+        if self.workers > 1 and len(candidates) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(candidates))) as pool:
+                results = list(pool.map(lambda c: self.safe_times(*c), candidates))
+        else:
+            results = [self.safe_times(*c) for c in candidates]
+        slots = [(f, d, t) for (f, d), times in zip(candidates, results) for t in times]
+        return sorted(slots, key=self.slot_key)
@@ -1,34 +1,38 @@
 import argparse
+import asyncio
+import atexit
 import time
 import json
 import random
-import requests
-import configparser
-import traceback
-import yaml
-from datetime import datetime
-
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait as Wait
-from selenium.webdriver.common.by import By
-from webdriver_manager.chrome import ChromeDriverManager
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--config', default='config.ini')
-args = parser.parse_args()
+import logging
+
+import driver_factory
+from driver_pool import DriverPool
+from http_client import YatriSession, SessionExpired
+from pages import payment_table
+from notifier import TelegramNotifier, TELEGRAM_API
+from adaptive_scheduler import AdaptiveScheduler
+from account_health import AccountHealth, ACTIVE, SUSPECT, BANNED
+from session_cache import SessionCache
+from availability_cache import AvailabilityCache, feed_key
+from login_steps import login_steps, run_steps, format_timings
+import metrics
+import settings
+import log_pipeline
 
 config = {}
-with open(args.config) as f:
-    config = yaml.load(f, Loader=yaml.loader.SafeLoader)
+notifier = None
+health = None
+scheduler = None
+session_cache = None
+availability = None
+# country_code -> the payment table last passed to on_appointments
+latest_appointments = {}
+log = logging.getLogger("visa_no_payment")
 
 # Time Section:
 minute = 60
 hour = 60 * minute
-# Time between steps (interactions with forms)
-STEP_TIME = 3.0
 
 
 def get_links_for_embassy(user_config, embassy_config):
@@ -36,162 +40,358 @@ def get_links_for_embassy(user_config, embassy_config):
     group_id = user_config['group_id']
     country_code = embassy_config['country_code']
     facility_id = embassy_config['facility_id']
+    # Only changed to run against a local stand-in of the site (bench/mock_site.py)
+    base_url = config['base_url']
     return {
-        'sign_in_link': f"https://ais.usvisa-info.com/{country_code}/niv/users/sign_in",
-        'appointment_url': f"https://ais.usvisa-info.com/{country_code}/niv/schedule/{schedule_id}/appointment",
-        'payment_url': f"https://ais.usvisa-info.com/{country_code}/niv/schedule/{schedule_id}/payment",
-        'date_url': f"https://ais.usvisa-info.com/{country_code}/niv/schedule/{schedule_id}/appointment/days/{facility_id}.json?appointments[expedite]=false",
-        'time_url': f"https://ais.usvisa-info.com/{country_code}/niv/schedule/{schedule_id}/appointment/times/{facility_id}.json?date=%s&appointments[expedite]=false",
-        'sign_out_link': f"https://ais.usvisa-info.com/{country_code}/niv/users/sign_out",
-        'group_link': f"https://ais.usvisa-info.com/en-il/niv/groups/{group_id}",
+        'sign_in_link': f"{base_url}/{country_code}/niv/users/sign_in",
+        'appointment_url': f"{base_url}/{country_code}/niv/schedule/{schedule_id}/appointment",
+        'payment_url': f"{base_url}/{country_code}/niv/schedule/{schedule_id}/payment",
+        'date_url': f"{base_url}/{country_code}/niv/schedule/{schedule_id}/appointment/days/{facility_id}.json?appointments[expedite]=false",
+        'time_url': f"{base_url}/{country_code}/niv/schedule/{schedule_id}/appointment/times/{facility_id}.json?date=%s&appointments[expedite]=false",
+        'sign_out_link': f"{base_url}/{country_code}/niv/users/sign_out",
+        'group_link': f"{base_url}/en-il/niv/groups/{group_id}",
     }
 
 
 def send_notification(title, msg):
-    data = {
-        'chat_id': config['telegram']['chat_id'],
-        'text': msg,
-    }
-    token = config['telegram']['bot_token']
-    url = f'https://api.telegram.org/bot{token}/sendMessage'
-    if config['telegram']['thread_id']:
-        data.update({'message_thread_id': config['telegram']['thread_id']})
-    print(f"Sending notification {data}")
-    requests.post(url, data)
-
-
-def auto_action(label, find_by, el_type, action, value, sleep_time=0):
-    print("\t"+ label +":", end="")
-    # Find Element By
-    match find_by.lower():
-        case 'id':
-            item = driver.find_element(By.ID, el_type)
-        case 'name':
-            item = driver.find_element(By.NAME, el_type)
-        case 'class':
-            item = driver.find_element(By.CLASS_NAME, el_type)
-        case 'xpath':
-            item = driver.find_element(By.XPATH, el_type)
-        case _:
-            return 0
-    # Do Action:
-    match action.lower():
-        case 'send':
-            item.send_keys(value)
-        case 'click':
-            item.click()
-        case _:
-            return 0
-    print("\t\tCheck!")
-    if sleep_time:
-        time.sleep(sleep_time)
-
-
-def start_process(user_config, embassy_config, embassy_links):
+    thread_id = config['telegram']['message_thread_id']
+    log.info(f"Sending notification {title}: {msg}")
+    notifier.send(config['telegram']['chat_id'], msg, thread_id)
+
+
+def notify_appointments(email, embassy_config, appointments):
+    send_notification('SUCCESS', json.dumps(appointments, sort_keys=True))
+
+
+# Called with every changed payment table; the coordinator replaces it
+on_appointments = notify_appointments
+
+
+def start_process(driver, user_config, embassy_config, embassy_links):
     # Bypass reCAPTCHA
     driver.get(embassy_links['sign_in_link'])
-    time.sleep(STEP_TIME)
-    Wait(driver, 60).until(EC.presence_of_element_located((By.NAME, "commit")))
-    auto_action("Click bounce", "xpath", '//a[@class="down-arrow bounce"]', "click", "", STEP_TIME)
-    auto_action("Email", "id", "user_email", "send", user_config['email'], STEP_TIME)
-    auto_action("Password", "id", "user_password", "send", user_config['password'], STEP_TIME)
-    auto_action("Privacy", "class", "icheckbox", "click", "", STEP_TIME)
-    auto_action("Enter Panel", "name", "commit", "click", "", STEP_TIME)
-    Wait(driver, 60).until(EC.presence_of_element_located((By.XPATH, "//a[contains(text(), '" + embassy_config['continue'] + "')]")))
-    print("\n\tlogin successful!\n")
-    print(f'Cookies: {driver.get_cookies()}')
-
-
-def get_first_available_appointments(embassy_links):
+    timings = run_steps(driver, login_steps(user_config['email'], user_config['password'], embassy_config['continue']))
+    log.info(f"Login successful for {user_config['email']}")
+    log.info(format_timings(timings), extra={'login_steps': dict(timings)})
+
+
+PAYMENT_TABLE_SCRIPT = """
+return Array.from(document.querySelectorAll('#paymentOptions table tbody tr'))
+    .map(row => Array.from(row.cells).map(cell => cell.innerText.trim()));
+"""
+
+
+def no_appointments(appointments):
+    # Every location "No Appointments Available": what a banned account sees
+    return all(x == "No Appointments Available" for x in appointments.values())
+
+
+def is_shareable(appointments):
+    # Only a table with availability goes to the other accounts: an empty one
+    # may just mean the account that fetched it is banned
+    return bool(appointments) and not no_appointments(appointments)
+
+
+def login(driver, user_config, embassy_config, embassy_links):
+    # Reuse the cached session when it is still valid, otherwise log in
+    base_url = config['base_url']
+    if session_cache.restore(user_config['email'], driver, embassy_links['payment_url'], base_url):
+        return
+    start_process(driver, user_config, embassy_config, embassy_links)
+    session_cache.save(user_config['email'], driver)
+
+
+def get_first_available_appointments(driver, embassy_links):
+    # location -> status for every row of the payment table: one page load and
+    # one script call in the browser. No rows means the browser was signed out
+    # and landed on sign_in.
     driver.get(embassy_links['payment_url'])
-    res = {}
-    for i in range(1, 3):
-        location = driver.find_elements(by=By.XPATH, value=f'//*[@id="paymentOptions"]/div[2]/table/tbody/tr[{i}]/td[1]')
-        status = driver.find_elements(by=By.XPATH, value=f'//*[@id="paymentOptions"]/div[2]/table/tbody/tr[{i}]/td[2]')
-        if not location or not status:
-            return None
-        location = location[0].text
-        status = status[0].text
-        res[location] = status
-    return res
-
-
-if config['chrome_driver']['local_use']:
-    options = Options()
-    options.add_argument("--headless")
-    options.add_argument("--disable-extensions")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--no-sandbox")
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-else:
-    driver = webdriver.Remote(command_executor=config['chrome_driver']['hub_address'], options=webdriver.ChromeOptions())
-
-def get_user_id():
-    id = 0
-    while True:
-        yield id
-        id = (id + 1) % len(config['users'])
+    rows = driver.execute_script(PAYMENT_TABLE_SCRIPT)
+    appointments = {row[0]: row[1] for row in rows if len(row) >= 2 and row[0]}
+    if not appointments:
+        raise SessionExpired(f"no payment table at {driver.current_url}")
+    return appointments
 
 
-if __name__ == "__main__":
-    first_loop = True
-    prev_available_appointments = None
-    get_user = get_user_id()
-    user_id = None
-    banned_count = 0
-    while 1:
+def new_driver():
+    return driver_factory.new_driver(config['chrome_driver']['local_use'], config['chrome_driver']['hub_address'])
+
+
+class AccountSession:
+    # One logged-in browser per (account, country), shared by the pollers of
+    # every facility of that country. Selenium calls are blocking, so they run
+    # in worker threads and the lock keeps one command in flight per browser.
+    def __init__(self, user_config, embassy_config):
+        self.user_config = user_config
+        self.embassy_config = embassy_config
+        self.links = get_links_for_embassy(user_config, embassy_config)
+        self.lock = asyncio.Lock()
+        self.pool = DriverPool(
+            new_driver,
+            lambda driver: login(driver, self.user_config, self.embassy_config, self.links),
+            config['chrome_driver']['pool_size'],
+        )
+        self.driver = None
+        self.http_session = None
+        self.logged_in = False
+        self.t0 = None
+        self.req_count = 0
+        # Signed out again and again in a row, login or not
+        self.expiries = 0
+
+    @property
+    def email(self):
+        return self.user_config['email']
+
+    async def login(self):
+        self.pool.start()
+        with metrics.timed("login", account=self.email, country=self.embassy_config['country_code']):
+            self.driver = await asyncio.to_thread(self.pool.acquire)
+        metrics.inc("logins", account=self.email, country=self.embassy_config['country_code'])
+        if config['chrome_driver']['http_polling']:
+            self.http_session = await asyncio.to_thread(YatriSession.from_driver, self.driver, self.links['payment_url'])
+        self.logged_in = True
+        self.t0 = time.time()
+        self.req_count = 0
+
+    def get_appointments(self):
+        # Plain HTTP when possible; once that session expired, the browser
+        if self.http_session is not None:
+            try:
+                appointments = payment_table(self.http_session.get_html(self.links['payment_url']))
+                if appointments:
+                    return appointments
+                raise SessionExpired(f"no payment table at {self.links['payment_url']}")
+            except SessionExpired as e:
+                log.warning(f"HTTP session of {self.email} expired ({e}), falling back to the browser")
+                self.http_session.close()
+                self.http_session = None
+        return get_first_available_appointments(self.driver, self.links)
+
+    def drop(self):
+        # Lose the browser but keep the session cached for the next login
+        self.logged_in = False
+        if self.http_session is not None:
+            session_cache.remember(self.email, "_yatri_session", self.http_session.session_cookie)
+            self.http_session.close()
+            self.http_session = None
+        self.pool.discard(self.driver)
+        self.driver = None
+
+    async def sign_out(self):
+        session_cache.invalidate(self.email)
+        self.logged_in = False
+        if self.http_session is not None:
+            self.http_session.close()
+            self.http_session = None
+        if self.driver is None:
+            return
         try:
-            if first_loop:
-                user_id = next(get_user)
-                embassy_config = config['embassies'][0]
-                links = get_links_for_embassy(config['users'][user_id], embassy_config)
-                t0 = time.time()
-                total_time = 0
-                Req_count = 0
-                start_process(
-                    user_config=config['users'][user_id],
-                    embassy_config=embassy_config,
-                    embassy_links=links,
-                )
-                first_loop = False
-
-            Req_count += 1
-            print("-" * 60 + f"\nRequest count: {Req_count}, Log time: {datetime.today()}\n")
-            appointments = get_first_available_appointments(links)
-            if all(x == "No Appointments Available" for x in appointments.values()):
-                print(f"Probably user {config['users'][user_id]['email']} is banned")
-                banned_count += 1
-                if banned_count == len(config['users']):
-                    print(f"All users are banned, resting for {config['time']['ban_cooldown_hours']}h")
-                    time.sleep(config['time']['ban_cooldown_hours'] * hour)
-                    banned_count = 0
-                driver.get(links['sign_out_link'])
-                first_loop = True
-                continue
-            if appointments is not None and appointments != prev_available_appointments:
-                send_notification('SUCCESS', json.dumps(appointments, sort_keys=True))
-            else:
-                RETRY_WAIT_TIME = random.randint(config['time']['retry_lower_bound'], config['time']['retry_upper_bound'])
-                t1 = time.time()
-                total_time = t1 - t0
-                msg = "\nWorking Time:  ~ {:.2f} minutes".format(total_time/minute)
-                print(msg)
+            await asyncio.to_thread(self.driver.get, self.links['sign_out_link'])
+        except Exception:
+            log.exception(f"Sign out of {self.email} failed")
+        self.pool.discard(self.driver)
+        self.driver = None
+
+    async def rest(self, sign_out=False):
+        # Called with the lock held: every facility of this account waits
+        # until its health allows polling again; other accounts keep going.
+        # Only a ban or a work break signs out; after a short error the
+        # cached session is kept for the next login.
+        if sign_out:
+            await self.sign_out()
+            self.pool.suspend()
+        wait = health.wait_time(self.email)
+        log.info(f"Account {self.email} is {health.state(self.email)}, resting {wait/minute:.0f} minutes")
+        await asyncio.sleep(wait)
+
+
+def poll_share(email):
+    # Polls go to the healthiest accounts: while an active account watches the
+    # same facilities, a suspect one polls at half the rate
+    ranked = health.healthiest([u['email'] for u in config['users']])
+    if ranked and ranked[0] != email and health.state(email) == SUSPECT and health.state(ranked[0]) == ACTIVE:
+        return 2
+    return 1
+
+
+async def poll_facility(session, embassy_config):
+    label = f"{session.email} @ {embassy_config['country_code']}/{embassy_config['facility_id']}"
+    labels = {'account': session.email, 'facility': embassy_config['facility_id']}
+    # Spread the first logins so the accounts don't all hit sign_in at once
+    await asyncio.sleep(random.uniform(0, config['time']['retry_lower_bound']))
+    while True:
+        try:
+            async with session.lock:
+                if not health.is_available(session.email):
+                    await session.rest(sign_out=health.state(session.email) == BANNED)
+                if not session.logged_in:
+                    await session.login()
+                session.req_count += 1
+                metrics.inc("polls", **labels)
+                log.info(f"[{label}] Request count: {session.req_count}", extra=dict(labels, request_count=session.req_count))
+                # The payment page lists every location of the country: one fetch
+                # serves all pollers of that country, whichever account they use
+                with metrics.timed("get_appointments", **labels):
+                    appointments, fetched = await asyncio.to_thread(
+                        availability.get,
+                        feed_key(config['base_url'], embassy_config['country_code'], "payment"),
+                        session.get_appointments,
+                        session.email,
+                        is_shareable,
+                    )
+                changed = bool(appointments) and appointments != latest_appointments.get(embassy_config['country_code'])
+                # No appointments anywhere is a strike, never news
+                strike = bool(appointments) and no_appointments(appointments)
+                if fetched:
+                    # A payment table, even a strike one, proves the session works
+                    if appointments:
+                        session.expiries = 0
+                    # Only the account that sent the request learns about its own health
+                    if strike:
+                        if health.report_empty(session.email) == BANNED:
+                            metrics.inc("bans", **labels)
+                            log.warning(f"[{label}] Probably user {session.email} is banned")
+                            await session.rest(sign_out=True)
+                            continue
+                    elif appointments:
+                        health.report_ok(session.email)
+                    scheduler.record(session.email, embassy_config['facility_id'], changed and not strike)
+                # A strike table is never stored either, or the next real table
+                # would count as a change and be announced again
+                if changed and not strike:
+                    latest_appointments[embassy_config['country_code']] = appointments
+                    on_appointments(session.email, embassy_config, appointments)
+                total_time = time.time() - session.t0
+                log.debug(f"[{label}] Working Time:  ~ {total_time/minute:.2f} minutes")
                 if total_time > config['time']['work_limit_hours'] * hour:
-                    # Let program rest a little
-                    print("REST", f"Break-time after {config['time']['work_limit_hours']} hours | Repeated {Req_count} times")
-                    driver.get(links['sign_out_link'])
-                    time.sleep(config['time']['work_cooldown_hours'] * hour)
-                    first_loop = True
-                else:
-                    msg = "Retry Wait Time: "+ str(RETRY_WAIT_TIME)+ " seconds"
-                    print(msg)
-                    time.sleep(RETRY_WAIT_TIME)
-            if appointments is not None:
-                prev_available_appointments = appointments
-        except:
-            # Exception Occured
-            print(f"Break the loop after exception! I will continue in a few minutes\n")
-            END_MSG_TITLE = "EXCEPTION"
-            traceback.print_exc()
-            # send_notification(END_MSG_TITLE, msg)
-            time.sleep(random.randint(config['time']['retry_lower_bound'], config['time']['retry_upper_bound']))
+                    # Let this account rest a little
+                    log.info(f"[{label}] Break-time after {config['time']['work_limit_hours']} hours | Repeated {session.req_count} times")
+                    health.cool(session.email, config['time']['work_cooldown_hours'] * hour)
+                    await session.rest(sign_out=True)
+                    continue
+        except SessionExpired as e:
+            # Signed out: log in again at once, without the dead cached session.
+            # Signed out again right after: the page may have changed or the
+            # account be locked, so cool down (longer each time) instead of
+            # logging in on every poll.
+            session.expiries += 1
+            metrics.inc("session_expired", **labels)
+            session.drop()
+            session_cache.invalidate(session.email)
+            if session.expiries > 1:
+                cooldown = min(config['time']['retry_upper_bound'] * 2 ** (session.expiries - 2), config['time']['work_cooldown_hours'] * hour)
+                log.warning(f"[{label}] Signed out ({e}) {session.expiries} times in a row, cooling down {cooldown/minute:.0f} minutes")
+                health.cool(session.email, cooldown)
+            else:
+                log.warning(f"[{label}] Signed out ({e}), logging in again")
+        except Exception:
+            log.exception(f"[{label}] Break the loop after exception! I will continue in a few minutes")
+            metrics.inc("exceptions", **labels)
+            health.cool(session.email, config['time']['retry_upper_bound'])
+            session.drop()
+        RETRY_WAIT_TIME = round(scheduler.next_delay(session.email, embassy_config['facility_id']) * poll_share(session.email))
+        log.debug(f"[{label}] Retry Wait Time: {RETRY_WAIT_TIME} seconds")
+        metrics.inc("sleep_seconds", RETRY_WAIT_TIME, **labels)
+        await asyncio.sleep(RETRY_WAIT_TIME)
+
+
+def load_config(path):
+    return settings.load(path)
+
+
+def setup(new_config, appointments_callback=None):
+    global config, notifier, health, scheduler, session_cache, availability, on_appointments
+    config = new_config
+    notifier = TelegramNotifier(config['telegram']['bot_token'], config['telegram']['api_url'] or TELEGRAM_API)
+    health = AccountHealth(config['account_health_file'], ban_cooldown=config['time']['ban_cooldown_hours'] * hour)
+    scheduler = AdaptiveScheduler(
+        config['time']['retry_lower_bound'],
+        config['time']['retry_upper_bound'],
+        config['time']['work_limit_hours'],
+        config['time']['request_budget'],
+    )
+    session_cache = SessionCache(config['session_file'])
+    availability = AvailabilityCache(config['availability_cache']['ttl'], config['availability_cache']['dir'])
+    on_appointments = appointments_callback or notify_appointments
+
+
+def apply_config(new_config):
+    # Timings apply from the next poll of every facility; accounts and
+    # facilities are matched up by sync_pollers()
+    global config
+    config = new_config
+    scheduler.configure(
+        config['time']['retry_lower_bound'],
+        config['time']['retry_upper_bound'],
+        config['time']['work_limit_hours'],
+        config['time']['request_budget'],
+    )
+    health.ban_cooldown = config['time']['ban_cooldown_hours'] * hour
+    availability.ttl = config['availability_cache']['ttl']
+
+
+def setup_logging():
+    # JSON lines with passwords and the bot token redacted; see `logging` in config.yaml
+    log_config = config['logging']
+    secrets = [u['password'] for u in config['users']] + [config['telegram']['bot_token']]
+    log_pipeline.setup(log_config['level'], log_config['file'], log_config['console_level'], log_config['max_mb'] * 2**20, secrets)
+    atexit.register(log_pipeline.shutdown)
+
+
+async def retire(session):
+    await session.sign_out()
+    session.pool.close()
+
+
+def sync_pollers(sessions, pollers):
+    # One poller per (account, country, facility) in the config. Pollers and
+    # sessions that are still configured keep running untouched, so a reload
+    # never logs an account in again.
+    wanted = set()
+    for user_config in config['users']:
+        for embassy_config in config['embassies']:
+            key = (user_config['email'], embassy_config['country_code'])
+            session = sessions.get(key)
+            if session is None:
+                session = sessions[key] = AccountSession(user_config, embassy_config)
+            elif session.user_config != user_config:
+                # A new password or schedule is used from the next login
+                session.user_config = user_config
+                session.links = get_links_for_embassy(user_config, session.embassy_config)
+            poller = key + (embassy_config['facility_id'],)
+            wanted.add(poller)
+            if poller not in pollers:
+                pollers[poller] = asyncio.create_task(poll_facility(session, embassy_config))
+    for poller in set(pollers) - wanted:
+        log.info(f"Stopped polling {poller[1]}/{poller[2]} with {poller[0]}")
+        pollers.pop(poller).cancel()
+    for key in set(sessions) - {p[:2] for p in wanted}:
+        asyncio.create_task(retire(sessions.pop(key)))
+
+
+async def main(config_path=None, reload_interval=10):
+    setup_logging()
+    notifier.start()
+    atexit.register(notifier.flush)
+    metrics.start(config['metrics']['port'], config['metrics']['json_file'])
+    sessions = {}
+    pollers = {}
+    sync_pollers(sessions, pollers)
+    watcher = settings.ConfigWatcher(config_path, config) if config_path else None
+    while True:
+        await asyncio.sleep(reload_interval)
+        new_config = watcher and watcher.poll()
+        if new_config:
+            apply_config(new_config)
+            sync_pollers(sessions, pollers)
+
+
+if __name__ == "__main__":
+    # Selenium loads in the background while the config is parsed
+    driver_factory.warm_up()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='config.yaml')
+    args = parser.parse_args()
+    setup(load_config(args.config))
+    asyncio.run(main(args.config))
@@ -1,77 +1,163 @@
 import argparse
+import atexit
+import itertools
 import time
 import json
-import random
 import requests
-import traceback
-import configparser
+import logging
+import threading
 from datetime import datetime
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait as Wait
-from selenium.webdriver.common.by import By
-from webdriver_manager.chrome import ChromeDriverManager
-
-from embassy import *
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--config', default='config.ini')
-args = parser.parse_args()
-
-config = configparser.ConfigParser()
-config.read(args.config)
-
-# Personal Info:
-# Account and current appointment info from https://ais.usvisa-info.com
-USERNAME = config['PERSONAL_INFO']['USERNAME']
-PASSWORD = config['PERSONAL_INFO']['PASSWORD']
-# Find SCHEDULE_ID in re-schedule page link:
-# https://ais.usvisa-info.com/en-am/niv/schedule/{SCHEDULE_ID}/appointment
-SCHEDULE_ID = config['PERSONAL_INFO']['SCHEDULE_ID']
-GROUP_ID = config['PERSONAL_INFO']['GROUP_ID']
-# Target Period:
-PRIOD_START = config['PERSONAL_INFO']['PRIOD_START']
-PRIOD_END = config['PERSONAL_INFO']['PRIOD_END']
-# Embassy Section:
-YOUR_EMBASSY = config['PERSONAL_INFO']['YOUR_EMBASSY']
-EMBASSY = Embassies[YOUR_EMBASSY][0]
-FACILITY_ID = Embassies[YOUR_EMBASSY][1]
-REGEX_CONTINUE = Embassies[YOUR_EMBASSY][2]
-
-# Notification:
-TELEGRAM_BOT_TOKEN = config['NOTIFICATION']['TELEGRAM_BOT_TOKEN']
-TELEGRAM_CHAT_ID = config['NOTIFICATION']['TELEGRAM_CHAT_ID']
-# TELEGRAM_MESSAGE_THREAD_ID = config['NOTIFICATION']['TELEGRAM_MESSAGE_THREAD_ID']
+import driver_factory
+from http_client import YatriSession, SessionExpired
+from driver_pool import DriverPool
+from login_steps import login_steps, run_steps, format_timings, LOCATORS
+from date_window import DateWindow, parse_windows, parse_dates
+from change_tracker import DateFeedTracker, format_delta
+from notifier import TelegramNotifier, TELEGRAM_API
+from fast_booking import AppointmentForm, StageTimer, FORM_FIELDS
+from history_store import HistoryStore
+from adaptive_scheduler import AdaptiveScheduler
+from account_health import AccountHealth, BANNED
+from session_cache import SessionCache
+from slot_selection import SlotSelector, parse_hours
+from availability_cache import AvailabilityCache, feed_key
+import metrics
+import settings
+import log_pipeline
+
+config = {}
+notifier = None
+session_cache = None
+pool = None
+driver = None
+http_session = None
+date_feed = None
+appointment_form = None
+availability = None
+selector = None
+history = None
+health = None
+scheduler = None
+log = logging.getLogger("visa_reschedule")
+http_lock = threading.Lock()
+browser_lock = threading.Lock()
+# Slots tried per detection before waiting for the next poll
+BOOKING_ATTEMPTS = 3
+# Account, embassy and site of the last config reload, warned about once
+requested_restart = None
 
 # Time Section:
 minute = 60
 hour = 60 * minute
-# Time between steps (interactions with forms)
-STEP_TIME = 0.5
-# Time between retries/checks for available dates (seconds)
-RETRY_TIME_L_BOUND = config['TIME'].getfloat('RETRY_TIME_L_BOUND')
-RETRY_TIME_U_BOUND = config['TIME'].getfloat('RETRY_TIME_U_BOUND')
-# Cooling down after WORK_LIMIT_TIME hours of work (Avoiding Ban)
-WORK_LIMIT_TIME = config['TIME'].getfloat('WORK_LIMIT_TIME')
-WORK_COOLDOWN_TIME = config['TIME'].getfloat('WORK_COOLDOWN_TIME')
-# Temporary Banned (empty list): wait COOLDOWN_TIME hours
-BAN_COOLDOWN_TIME = config['TIME'].getfloat('BAN_COOLDOWN_TIME')
-
-# CHROMEDRIVER
-# Details for the script to control Chrome
-LOCAL_USE = config['CHROMEDRIVER'].getboolean('LOCAL_USE')
-# Optional: HUB_ADDRESS is mandatory only when LOCAL_USE = False
-HUB_ADDRESS = config['CHROMEDRIVER']['HUB_ADDRESS']
-
-SIGN_IN_LINK = f"https://ais.usvisa-info.com/{EMBASSY}/niv/users/sign_in"
-APPOINTMENT_URL = f"https://ais.usvisa-info.com/{EMBASSY}/niv/schedule/{SCHEDULE_ID}/appointment"
-DATE_URL = f"https://ais.usvisa-info.com/{EMBASSY}/niv/schedule/{SCHEDULE_ID}/appointment/days/{FACILITY_ID}.json?appointments[expedite]=false"
-TIME_URL = f"https://ais.usvisa-info.com/{EMBASSY}/niv/schedule/{SCHEDULE_ID}/appointment/times/{FACILITY_ID}.json?date=%s&appointments[expedite]=false"
-SIGN_OUT_LINK = f"https://ais.usvisa-info.com/{EMBASSY}/niv/users/sign_out"
-GROUP_LINK = f"https://ais.usvisa-info.com/en-il/niv/groups/{GROUP_ID}"
+
+
+def read_settings(new_config):
+    # config.ini or config.yaml (the first user and embassy), already validated
+    global config
+    global USER, EMBASSY_CONFIG, USERNAME, PASSWORD, SCHEDULE_ID, GROUP_ID, EMBASSY, FACILITY_ID
+    global REGEX_CONTINUE, BASE_URL, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, TELEGRAM_MESSAGE_THREAD_ID
+    global TELEGRAM_API_URL, HISTORY_DIR, HEALTH_FILE, SESSION_FILE, METRICS_PORT, METRICS_JSON_FILE
+    global AVAILABILITY_CACHE_DIR, AVAILABILITY_CACHE_TTL, LABELS, LOG_LEVEL, LOG_CONSOLE_LEVEL, LOG_FILE
+    global LOG_MAX_MB, LOCAL_USE, HUB_ADDRESS, HTTP_POLLING, POOL_SIZE
+    global SIGN_IN_LINK, APPOINTMENT_URL, DATE_URL, TIME_URL, DAYS_KEY, SIGN_OUT_LINK, GROUP_LINK
+    config = new_config
+    USER = config['users'][0]
+    EMBASSY_CONFIG = config['embassies'][0]
+
+    # Personal Info:
+    # Account and current appointment info from https://ais.usvisa-info.com
+    USERNAME = USER['email']
+    PASSWORD = USER['password']
+    # Find SCHEDULE_ID in re-schedule page link:
+    # https://ais.usvisa-info.com/en-am/niv/schedule/{SCHEDULE_ID}/appointment
+    SCHEDULE_ID = USER['schedule_id']
+    GROUP_ID = USER['group_id']
+    # Embassy Section:
+    EMBASSY = EMBASSY_CONFIG['country_code']
+    FACILITY_ID = EMBASSY_CONFIG['facility_id']
+    REGEX_CONTINUE = EMBASSY_CONFIG['continue']
+    # Only changed to run against a local stand-in of the site (bench/mock_site.py)
+    BASE_URL = config['base_url']
+
+    # Notification:
+    TELEGRAM_BOT_TOKEN = config['telegram']['bot_token']
+    TELEGRAM_CHAT_ID = config['telegram']['chat_id']
+    TELEGRAM_MESSAGE_THREAD_ID = config['telegram']['message_thread_id']
+    TELEGRAM_API_URL = config['telegram']['api_url'] or TELEGRAM_API
+
+    # History: every poll result is stored in this directory (empty = disabled)
+    HISTORY_DIR = config['history_dir']
+    # Account states (active/suspect/cooling/banned) survive restarts in this file
+    HEALTH_FILE = config['account_health_file']
+    # Login cookies reused across restarts while the site still accepts them (empty = always log in)
+    SESSION_FILE = config['session_file']
+
+    # Metrics: Prometheus endpoint on http://127.0.0.1:PORT/metrics and/or a JSON dump (empty = off)
+    METRICS_PORT = config['metrics']['port']
+    METRICS_JSON_FILE = config['metrics']['json_file']
+
+    # The days feed is shared with every bot on this facility using the same
+    # AVAILABILITY_CACHE_DIR, reused for AVAILABILITY_CACHE_TTL seconds
+    AVAILABILITY_CACHE_DIR = config['availability_cache']['dir']
+    AVAILABILITY_CACHE_TTL = config['availability_cache']['ttl']
+    LABELS = {'account': USERNAME, 'facility': FACILITY_ID}
+
+    # Logging: JSON lines in LOG_FILE ({date} = a file per day, empty = console only),
+    # rotated past LOG_MAX_MB; passwords, tokens and cookies are redacted
+    LOG_LEVEL = config['logging']['level']
+    LOG_CONSOLE_LEVEL = config['logging']['console_level']
+    LOG_FILE = config['logging']['file']
+    LOG_MAX_MB = config['logging']['max_mb']
+
+    # CHROMEDRIVER
+    # Details for the script to control Chrome
+    LOCAL_USE = config['chrome_driver']['local_use']
+    # Optional: HUB_ADDRESS is mandatory only when LOCAL_USE = False
+    HUB_ADDRESS = config['chrome_driver']['hub_address']
+    # Poll the JSON endpoints over plain HTTP once logged in (browser is the fallback)
+    HTTP_POLLING = config['chrome_driver']['http_polling']
+    # Logged in browsers kept warm on standby to replace a signed out one (0 = disabled)
+    POOL_SIZE = config['chrome_driver']['pool_size']
+
+    SIGN_IN_LINK = f"{BASE_URL}/{EMBASSY}/niv/users/sign_in"
+    APPOINTMENT_URL = f"{BASE_URL}/{EMBASSY}/niv/schedule/{SCHEDULE_ID}/appointment"
+    DATE_URL = f"{BASE_URL}/{EMBASSY}/niv/schedule/{SCHEDULE_ID}/appointment/days/{FACILITY_ID}.json?appointments[expedite]=false"
+    TIME_URL = f"{BASE_URL}/{EMBASSY}/niv/schedule/{SCHEDULE_ID}/appointment/times/{FACILITY_ID}.json?date=%s&appointments[expedite]=false"
+    DAYS_KEY = feed_key(BASE_URL, EMBASSY, FACILITY_ID, "days")
+    SIGN_OUT_LINK = f"{BASE_URL}/{EMBASSY}/niv/users/sign_out"
+    GROUP_LINK = f"{BASE_URL}/en-il/niv/groups/{GROUP_ID}"
+    read_live_settings(config)
+
+
+def read_live_settings(config):
+    # The settings a config reload changes without logging in again
+    global PRIOD_END, DATE_WINDOW, TOP_DATES, PREFERRED_HOURS
+    global RETRY_TIME_L_BOUND, RETRY_TIME_U_BOUND, WORK_LIMIT_TIME, WORK_COOLDOWN_TIME, BAN_COOLDOWN_TIME, REQUEST_BUDGET
+    # Target Period, or several preferred windows "start:end, start:end" instead,
+    # and dates never to book "date, date"
+    windows = parse_windows(config['preferred_windows'])
+    if config['period_start'] and config['period_end']:
+        windows = windows or [(config['period_start'], config['period_end'])]
+    if not windows:
+        raise settings.ConfigError("period_start/period_end or preferred_windows is required")
+    PRIOD_END = config['period_end'] or max(end for _, end in windows)
+    DATE_WINDOW = DateWindow(windows, parse_dates(config['blackout_dates']))
+    # Slot selection: time lists of the TOP_DATES earliest dates are fetched together
+    # and slots in PREFERRED_HOURS "8, 9, 14" win within a date
+    TOP_DATES = config['top_dates']
+    PREFERRED_HOURS = parse_hours(config['preferred_hours'])
+    # Time between retries/checks for available dates (seconds)
+    RETRY_TIME_L_BOUND = config['time']['retry_lower_bound']
+    RETRY_TIME_U_BOUND = config['time']['retry_upper_bound']
+    # Cooling down after WORK_LIMIT_TIME hours of work (Avoiding Ban)
+    WORK_LIMIT_TIME = config['time']['work_limit_hours']
+    WORK_COOLDOWN_TIME = config['time']['work_cooldown_hours']
+    # Temporary Banned (empty list): wait COOLDOWN_TIME hours
+    BAN_COOLDOWN_TIME = config['time']['ban_cooldown_hours']
+    # Max requests per WORK_LIMIT_TIME window; default: the volume of uniform retries
+    REQUEST_BUDGET = config['time']['request_budget']
+
 
 JS_SCRIPT = ("var req = new XMLHttpRequest();"
              f"req.open('GET', '%s', false);"
@@ -83,104 +169,145 @@ JS_SCRIPT = ("var req = new XMLHttpRequest();"
 
 
 def send_notification(title, msg):
-    print(f"Sending notification!")
-    if TELEGRAM_BOT_TOKEN:
-        url = f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage'
-        data = {
-            'chat_id': TELEGRAM_CHAT_ID,
-            # 'message_thread_id': TELEGRAM_MESSAGE_THREAD_ID,
-            'text': msg,
-        }
-        requests.post(url, data)
-
-
-def auto_action(label, find_by, el_type, action, value, sleep_time=0):
-    print("\t"+ label +":", end="")
-    # Find Element By
-    match find_by.lower():
-        case 'id':
-            item = driver.find_element(By.ID, el_type)
-        case 'name':
-            item = driver.find_element(By.NAME, el_type)
-        case 'class':
-            item = driver.find_element(By.CLASS_NAME, el_type)
-        case 'xpath':
-            item = driver.find_element(By.XPATH, el_type)
-        case _:
-            return 0
-    # Do Action:
-    match action.lower():
-        case 'send':
-            item.send_keys(value)
-        case 'click':
-            item.click()
-        case _:
-            return 0
-    print("\t\tCheck!")
-    if sleep_time:
-        time.sleep(sleep_time)
-
-
-def start_process():
+    log.info(f"Sending notification {title}")
+    notifier.send(TELEGRAM_CHAT_ID, msg, TELEGRAM_MESSAGE_THREAD_ID)
+
+
+def start_process(driver):
     # Bypass reCAPTCHA
     driver.get(SIGN_IN_LINK)
-    time.sleep(STEP_TIME)
-    Wait(driver, 60).until(EC.presence_of_element_located((By.NAME, "commit")))
-    auto_action("Click bounce", "xpath", '//a[@class="down-arrow bounce"]', "click", "", STEP_TIME)
-    auto_action("Email", "id", "user_email", "send", USERNAME, STEP_TIME)
-    auto_action("Password", "id", "user_password", "send", PASSWORD, STEP_TIME)
-    auto_action("Privacy", "class", "icheckbox", "click", "", STEP_TIME)
-    auto_action("Enter Panel", "name", "commit", "click", "", STEP_TIME)
-    Wait(driver, 60).until(EC.presence_of_element_located((By.XPATH, "//a[contains(text(), '" + REGEX_CONTINUE + "')]")))
-    print("\n\tlogin successful!\n")
-
-def reschedule(date):
-    time = get_time(date)
+    timings = run_steps(driver, login_steps(USERNAME, PASSWORD, REGEX_CONTINUE))
+    log.info("Login successful")
+    log.info(format_timings(timings), extra={"login_steps": dict(timings)})
+
+def get_form_fields():
+    # Hidden fields of the reschedule form: prefetched over HTTP, scraped otherwise
+    if http_session is not None:
+        return appointment_form.get(http_session)
     driver.get(APPOINTMENT_URL)
+    return {name: driver.find_element(by=LOCATORS['name'], value=name).get_attribute('value') for name in FORM_FIELDS}
+
+
+def post_appointment(data):
+    if http_session is not None:
+        return http_session.post_form(APPOINTMENT_URL, data)
     headers = {
         "User-Agent": driver.execute_script("return navigator.userAgent;"),
         "Referer": APPOINTMENT_URL,
         "Cookie": "_yatri_session=" + driver.get_cookie("_yatri_session")["value"]
     }
+    return requests.post(APPOINTMENT_URL, headers=headers, data=data)
+
+
+def prefetch_form():
+    # Keep the reschedule form ready while waiting for the next poll
+    if http_session is None or not appointment_form.is_stale():
+        return
+    try:
+        appointment_form.refresh(http_session)
+    except Exception:
+        log.exception("Prefetching the reschedule form failed")
+        appointment_form.invalidate()
+
+
+def reschedule(date, time, timer):
     data = {
-        "utf8": driver.find_element(by=By.NAME, value='utf8').get_attribute('value'),
-        "authenticity_token": driver.find_element(by=By.NAME, value='authenticity_token').get_attribute('value'),
-        "confirmed_limit_message": driver.find_element(by=By.NAME, value='confirmed_limit_message').get_attribute('value'),
-        "use_consulate_appointment_capacity": driver.find_element(by=By.NAME, value='use_consulate_appointment_capacity').get_attribute('value'),
+        **get_form_fields(),
         "appointments[consulate_appointment][facility_id]": FACILITY_ID,
         "appointments[consulate_appointment][date]": date,
         "appointments[consulate_appointment][time]": time,
     }
-    r = requests.post(APPOINTMENT_URL, headers=headers, data=data)
+    timer.mark("form")
+    r = post_appointment(data)
+    timer.mark("post")
+    # The token belongs to the page the booking was made from
+    appointment_form.invalidate()
     if(r.text.find('Successfully Scheduled') != -1):
         title = "SUCCESS"
         msg = f"Rescheduled Successfully! {date} {time}"
+    elif r.status_code >= 400 or "sign_in" in r.url:
+        # Rejected whatever the slot: bad token, expired cookie, blocked
+        title = "ERROR"
+        msg = f"Reschedule Rejected ({r.status_code})!!! {date} {time}"
     else:
         title = "FAIL"
         msg = f"Reschedule Failed!!! {date} {time}"
+    msg += f"\nDetection to booking: {timer}"
+    metrics.observe("reschedule", timer.total, **LABELS)
+    metrics.inc("reschedules", result=title, **LABELS)
+    log.info(msg)
     return [title, msg]
 
 
-def get_dates():
-    # Requesting to get the whole available dates
-    session = driver.get_cookie("_yatri_session")["value"]
-    script = JS_SCRIPT % (str(DATE_URL), session)
-    content = driver.execute_script(script)
-    return json.loads(content)
+def book_best_slot(dates, detected_at=None):
+    # Tries the best BOOKING_ATTEMPTS ranked slots of the candidate dates until
+    # one is booked; a rejection that is not about the slot ends the attempts
+    timer = StageTimer(detected_at)
+    # Parallel time lookups need the HTTP session; the browser takes one at a time
+    selector.workers = TOP_DATES if http_session is not None else 1
+    slots = selector.rank([(FACILITY_ID, d) for d in dates])
+    timer.mark("time lookup")
+    title, msg = "FAIL", f"No free times for {', '.join(dates)}"
+    for _, date, time in slots[:BOOKING_ATTEMPTS]:
+        title, msg = reschedule(date, time, timer)
+        if title == "SUCCESS":
+            return title, msg, date
+        selector.invalidate(FACILITY_ID, date)
+        if title == "ERROR":
+            break
+    return title, msg, None
+
+
+def start_http_session():
+    global http_session
+    if http_session is not None:
+        http_session.close()
+    http_session = YatriSession.from_driver(driver, APPOINTMENT_URL) if HTTP_POLLING else None
+
+
+def fetch_json(url):
+    # Called from the time lookup threads too: the expired HTTP session is
+    # dropped once, under the lock (other lookups may still be using it, it is
+    # closed when they let go of it), and the browser runs one script at a time
+    global http_session
+    session = http_session
+    if session is not None:
+        try:
+            return session.get_json_text(url)
+        except SessionExpired as e:
+            with http_lock:
+                if http_session is session:
+                    log.warning(f"HTTP session expired ({e}), falling back to the browser")
+                    http_session = None
+    with browser_lock:
+        cookie = driver.get_cookie("_yatri_session")["value"]
+        return driver.execute_script(JS_SCRIPT % (str(url), cookie))
+
+
+def is_date_list(content):
+    # Only a non-empty feed is shared: an empty one may just mean this account is banned
+    return content.lstrip().startswith("[") and content.strip() != "[]"
 
-def get_time(date):
+
+def get_dates():
+    # Requesting to get the whole available dates, or reading them from another
+    # account on this facility that just did; returns (what changed since the
+    # last poll or None when the feed is unchanged, whether this account fetched)
+    with metrics.timed("get_dates", **LABELS):
+        content, fetched = availability.get(DAYS_KEY, lambda: fetch_json(DATE_URL), USERNAME, is_date_list)
+    return date_feed.update(content), fetched
+
+def get_times(facility_id, date):
     time_url = TIME_URL % date
-    session = driver.get_cookie("_yatri_session")["value"]
-    script = JS_SCRIPT % (str(time_url), session)
-    content = driver.execute_script(script)
-    data = json.loads(content)
-    time = data.get("available_times")[-1]
-    print(f"Got time successfully! {date} {time}")
-    return time
+    with metrics.timed("get_time", **LABELS):
+        content = fetch_json(time_url)
+    times = json.loads(content).get("available_times") or []
+    log.debug(f"Got times successfully! {date} {times}")
+    return times
 
 def get_current_appointment_date():
     driver.get(GROUP_LINK)
-    elements = driver.find_elements(by=By.CLASS_NAME, value="consular-appt")
+    elements = driver.find_elements(by=LOCATORS['class'], value="consular-appt")
     if not elements:
         return datetime.strptime(PRIOD_END, "%Y-%m-%d")
     date_str = ' '.join(elements[0].text.split(' ')[2:5])
@@ -194,126 +321,219 @@ def is_logged_in():
     return True
 
 
-def get_available_date(dates, current_appointment_date):
-    # Evaluation of different available dates
-    def is_in_period(date, PSD, PED):
-        new_date = datetime.strptime(date, "%Y-%m-%d")
-        result = ( PED > new_date and new_date > PSD )
-        # print(f'{new_date.date()} : {result}', end=", ")
-        return result
-
-    PED = datetime.strptime(PRIOD_END, "%Y-%m-%d")
-    if current_appointment_date:
-        PED = min(PED, current_appointment_date)
-    PSD = datetime.strptime(PRIOD_START, "%Y-%m-%d")
-    for d in dates:
-        date = d.get('date')
-        if is_in_period(date, PSD, PED):
-            return date
-    print(f"\n\nNo available dates between ({PSD.date()}) and ({PED.date()})!")
-
-
-def info_logger(file_path, log):
-    # file_path: e.g. "log.txt"
-    with open(file_path, "a") as file:
-        file.write(str(datetime.now().time()) + ":\n" + log + "\n")
-
-
-if LOCAL_USE:
-    options = Options()
-    options.add_argument("--headless")
-    options.add_argument("--disable-extensions")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--no-sandbox")
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-else:
-    driver = webdriver.Remote(command_executor=HUB_ADDRESS, options=webdriver.ChromeOptions())
-
-
-if __name__ == "__main__":
+def get_available_dates(dates, current_appointment_date):
+    # Evaluation of different available dates: the TOP_DATES best candidates
+    candidates = list(itertools.islice(DATE_WINDOW.candidates(dates, current_appointment_date), TOP_DATES))
+    if not candidates:
+        log.info(f"No available dates between {DATE_WINDOW} before ({current_appointment_date})!")
+    return candidates
+
+
+def new_driver():
+    return driver_factory.new_driver(LOCAL_USE, HUB_ADDRESS)
+
+
+def login(driver):
+    # Reuse the cached session when it is still valid, otherwise log in
+    if session_cache.restore(USERNAME, driver, DATE_URL, BASE_URL):
+        return
+    start_process(driver)
+    session_cache.save(USERNAME, driver)
+
+
+def remember_session():
+    if http_session is not None:
+        session_cache.remember(USERNAME, "_yatri_session", http_session.session_cookie)
+
+
+def sign_out():
+    session_cache.invalidate(USERNAME)
+    if driver is None:
+        return
+    try:
+        driver.get(SIGN_OUT_LINK)
+    except:
+        log.exception("Sign out failed")
+    pool.discard(driver)
+
+
+def setup(new_config):
+    # Settings and the objects built from them; nothing runs until main()
+    global notifier, session_cache, pool, date_feed, appointment_form, availability, selector, history, health, scheduler
+    read_settings(new_config)
+    notifier = TelegramNotifier(TELEGRAM_BOT_TOKEN, TELEGRAM_API_URL)
+    session_cache = SessionCache(SESSION_FILE)
+    pool = DriverPool(new_driver, login, POOL_SIZE)
+    date_feed = DateFeedTracker()
+    appointment_form = AppointmentForm(APPOINTMENT_URL)
+    availability = AvailabilityCache(AVAILABILITY_CACHE_TTL, AVAILABILITY_CACHE_DIR)
+    selector = SlotSelector(get_times, PREFERRED_HOURS, [FACILITY_ID], workers=TOP_DATES)
+    history = HistoryStore(HISTORY_DIR) if HISTORY_DIR else None
+    health = AccountHealth(HEALTH_FILE, ban_cooldown=BAN_COOLDOWN_TIME * hour)
+    scheduler = AdaptiveScheduler(RETRY_TIME_L_BOUND, RETRY_TIME_U_BOUND, WORK_LIMIT_TIME, REQUEST_BUDGET)
+
+
+def learn_release_hours():
+    if history:
+        scheduler.learn(FACILITY_ID, history.release_hours(FACILITY_ID, start=time.time() - 30 * 24 * hour))
+
+
+def apply_config(new_config):
+    # Windows, slot preferences and timings apply from the next poll, with the
+    # same browser and session; another account or embassy needs a restart
+    global requested_restart
+    requested = (new_config['users'][0], new_config['embassies'][0], new_config['base_url'])
+    if requested != (USER, EMBASSY_CONFIG, BASE_URL) and requested != requested_restart:
+        log.warning("Account, embassy and site changes only apply after a restart")
+    requested_restart = requested
+    try:
+        read_live_settings(new_config)
+    except settings.ConfigError as e:
+        log.error(f"Ignoring the new config: {e}")
+        return
+    selector.preferred_hours = PREFERRED_HOURS
+    scheduler.configure(RETRY_TIME_L_BOUND, RETRY_TIME_U_BOUND, WORK_LIMIT_TIME, REQUEST_BUDGET)
+    health.ban_cooldown = BAN_COOLDOWN_TIME * hour
+    availability.ttl = new_config['availability_cache']['ttl']
+    # Check the dates already on offer against the new windows
+    date_feed.reset()
+
+
+def main():
+    global driver
+    # Selenium loads in the background while the config is parsed
+    driver_factory.warm_up()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='config.ini')
+    args = parser.parse_args()
+    # config.ini or config.yaml, checked before anything starts
+    setup(settings.load(args.config))
+    atexit.register(remember_session)
+    if history:
+        atexit.register(history.close)
     first_loop = True
     previous_date = str(datetime.now().date())
-    previous_available_dates = ''
     current_appointment_date = None
+    # Dates a booking failed on, tried again while the feed still lists them
+    failed_dates = set()
+    watcher = settings.ConfigWatcher(args.config, config)
+    log_pipeline.setup(LOG_LEVEL, LOG_FILE, LOG_CONSOLE_LEVEL, LOG_MAX_MB * 2**20, [PASSWORD, TELEGRAM_BOT_TOKEN])
+    atexit.register(log_pipeline.shutdown)
+    pool.start()
+    notifier.start()
+    atexit.register(notifier.flush)
+    metrics.start(METRICS_PORT, METRICS_JSON_FILE)
+    learn_release_hours()
     while 1:
         try:
+            new_config = watcher.poll()
+            if new_config:
+                apply_config(new_config)
             current_date = str(datetime.now().date())
-            LOG_FILE_NAME = f"log_{current_date}.txt"
             if current_date != previous_date:
                 send_notification('NEW_DAY', f'Its a new day. No news. Still working...')
+                learn_release_hours()
             previous_date = current_date
             if first_loop:
+                wait = health.wait_time(USERNAME)
+                if wait:
+                    log.info(f"Account is {health.state(USERNAME)}, waiting {wait/minute:.0f} minutes")
+                    time.sleep(wait)
                 t0 = time.time()
                 total_time = 0
                 Req_count = 0
-                start_process()
+                with metrics.timed("login", **LABELS):
+                    driver = pool.acquire()
+                metrics.inc("logins", **LABELS)
+                start_http_session()
+                appointment_form.invalidate()
+                # Re-evaluate the whole feed against the fresh appointment date
+                date_feed.reset()
                 current_appointment_date = get_current_appointment_date()
-                print('FIRST_RUN', f'Current appointment date: {current_appointment_date.strftime("%Y-%m-%d")}. Working...')
+                log.info(f'Current appointment date: {current_appointment_date.strftime("%Y-%m-%d")}. Working...')
                 first_loop = False
 
             Req_count += 1
-            msg = "-" * 60 + f"\nRequest count: {Req_count}, Log time: {datetime.today()}\n"
-            print(msg)
-            info_logger(LOG_FILE_NAME, msg)
-            available_dates = get_dates()
-            if not available_dates:
+            metrics.inc("polls", **LABELS)
+            log.info(f"Request count: {Req_count}", extra={'request_count': Req_count})
+            poll_started = time.perf_counter()
+            delta, fetched = get_dates()
+            if fetched:
+                # A feed read from the cache was recorded by the account that fetched it
+                if history:
+                    history.append(USERNAME, FACILITY_ID, sorted(date_feed.dates))
+                scheduler.record(USERNAME, FACILITY_ID, bool(delta and delta.added))
+            if not date_feed.dates:
                 # Ban Situation or just no slots
-                print('List is empty')
-                info_logger(LOG_FILE_NAME, msg)
-                send_notification("BAN", msg)
-                driver.get(SIGN_OUT_LINK)
-                time.sleep(BAN_COOLDOWN_TIME * hour)
-                first_loop = True
+                state = health.report_empty(USERNAME)
+                msg = f'List is empty, account {state}'
+                log.info(msg)
+                if state == BANNED:
+                    metrics.inc("bans", **LABELS)
+                    send_notification("BAN", msg)
+                    sign_out()
+                    pool.suspend()
+                    first_loop = True
+                    continue
+            elif delta is None:
+                if fetched:
+                    health.report_ok(USERNAME)
+                msg = f'No changes in {EMBASSY} ({len(date_feed.dates)} dates)'
+                log.info(msg)
             else:
-                # Print Available dates:
-                msg = ""
-                for d in available_dates:
-                    msg = msg + "%s" % (d.get('date')) + ", "
-                msg = f'Available dates in {EMBASSY}:\n {msg}'
-                print(msg)
-                if available_dates != previous_available_dates:
+                if fetched:
+                    health.report_ok(USERNAME)
+                # Print what changed in the available dates:
+                msg = f'Available dates in {EMBASSY} ({len(date_feed.dates)} dates):\n{format_delta(delta)}'
+                log.info(msg, extra={'added': delta.added, 'removed': delta.removed})
+                if delta.added or delta.removed:
                     send_notification('dates_available', msg)
-                info_logger(LOG_FILE_NAME, msg)
-                date = get_available_date(available_dates, current_appointment_date)
+            # Only newly released dates can be better than what was already checked,
+            # plus the dates a booking failed on while they are still listed
+            failed_dates &= date_feed.dates
+            new_dates = sorted(set(delta.added if delta else ()) | failed_dates)
+            dates = get_available_dates([{'date': d} for d in new_dates], current_appointment_date) if new_dates else []
+            if dates:
+                # Good dates to schedule for
+                END_MSG_TITLE, msg, date = book_best_slot(dates, poll_started)
+                send_notification(END_MSG_TITLE, msg)
                 if date:
-                    # A good date to schedule for
-                    END_MSG_TITLE, msg = reschedule(date)
-                    send_notification(END_MSG_TITLE, msg)
                     current_appointment_date = date
-                previous_available_dates = available_dates
-            RETRY_WAIT_TIME = random.randint(RETRY_TIME_L_BOUND, RETRY_TIME_U_BOUND)
+                    failed_dates.clear()
+                else:
+                    failed_dates.update(dates)
+            RETRY_WAIT_TIME = round(scheduler.next_delay(USERNAME, FACILITY_ID))
             t1 = time.time()
             total_time = t1 - t0
             msg = "\nWorking Time:  ~ {:.2f} minutes".format(total_time/minute)
-            print(msg)
-            info_logger(LOG_FILE_NAME, msg)
+            log.info(msg)
             if total_time > WORK_LIMIT_TIME * hour:
                 # Let program rest a little
-                print("REST", f"Break-time after {WORK_LIMIT_TIME} hours | Repeated {Req_count} times")
-                driver.get(SIGN_OUT_LINK)
-                time.sleep(WORK_COOLDOWN_TIME * hour)
+                log.info(f"Break-time after {WORK_LIMIT_TIME} hours | Repeated {Req_count} times")
+                health.cool(USERNAME, WORK_COOLDOWN_TIME * hour)
+                sign_out()
+                pool.suspend()
                 first_loop = True
             else:
                 msg = "Retry Wait Time: "+ str(RETRY_WAIT_TIME)+ " seconds"
-                print(msg)
-                info_logger(LOG_FILE_NAME, msg)
+                log.info(msg)
+                prefetch_form()
+                metrics.inc("sleep_seconds", RETRY_WAIT_TIME, **LABELS)
                 time.sleep(RETRY_WAIT_TIME)
         except:
             # Exception Occured
             # msg = f"Break the loop after exception! I will continue in a few minutes\n"
             # END_MSG_TITLE = "EXCEPTION"
-            traceback.print_exc()
+            log.exception("Break the loop after exception! I will continue in a few minutes")
+            metrics.inc("exceptions", **LABELS)
             # send_notification(END_MSG_TITLE, msg)
-            time.sleep(BAN_COOLDOWN_TIME)
+            health.cool(USERNAME, RETRY_TIME_U_BOUND)
             first_loop = True
-            try:
-                driver.get(SIGN_OUT_LINK)
-            except:
-                traceback.print_exc()
-
-print(msg)
-info_logger(LOG_FILE_NAME, msg)
-send_notification(END_MSG_TITLE, msg)
-driver.get(SIGN_OUT_LINK)
-driver.stop_client()
-driver.quit()
+            # Keep the session: after a short error it can usually be restored
+            remember_session()
+            pool.discard(driver)
+            driver = None
+
+
+if __name__ == "__main__":
+    main()